@@ -1,13 +1,12 @@
 import os
 import json
-import pickle
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from openai import OpenAI
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from ai_agent_feedback_utils import verify_event_in_calendar, log_feedback, summarize_feedback_log
+from google_api_service_cache import get_service
+from calendar_mirror import CalendarMirror
+from token_counter import count_tokens
+from ai_agent_feedback_utils import verify_event_in_events, log_feedback, summarize_feedback_log
 import gradio as gr
 
 # Load environment variables
@@ -29,6 +28,26 @@ SECRETS_DIR = os.getenv('SECRETS_DIR') or BASE_DIR
 CREDENTIALS_FILE = os.getenv('CREDENTIALS_FILE') or os.path.join(SECRETS_DIR, 'credentials.json')
 TOKEN_FILE = os.getenv('TOKEN_FILE') or os.path.join(SECRETS_DIR, 'token.pickle')
 
+# Local calendar mirror, kept current with incremental syncs
+DAEMON_DIR = os.getenv('DAEMON_DIR') or os.path.join(BASE_DIR, 'daemon')
+CALENDAR_MIRROR_FILE = os.getenv('CALENDAR_MIRROR_FILE') or os.path.join(DAEMON_DIR, 'calendar_mirror.sqlite3')
+# Reads sync the mirror first when its last sync is older than this (seconds)
+try:
+    CALENDAR_MIRROR_MAX_AGE = int(os.getenv('CALENDAR_MIRROR_MAX_AGE'))
+except (ValueError, TypeError):
+    CALENDAR_MIRROR_MAX_AGE = 60
+
+# Budget of the event list in the system prompt; events past it are only
+# summarized. 0 disables a limit, tokens are estimated without tiktoken.
+try:
+    CALENDAR_PROMPT_MAX_CHARS = int(os.getenv('CALENDAR_PROMPT_MAX_CHARS'))
+except (ValueError, TypeError):
+    CALENDAR_PROMPT_MAX_CHARS = 40000
+try:
+    CALENDAR_PROMPT_MAX_TOKENS = int(os.getenv('CALENDAR_PROMPT_MAX_TOKENS'))
+except (ValueError, TypeError):
+    CALENDAR_PROMPT_MAX_TOKENS = 0
+
 MODEL = os.getenv('LLM_MODEL') or 'gpt-4o'
 openai = OpenAI()
 
@@ -46,39 +65,83 @@ def logger(level, msg):
 # ----------------------- Google Calendar Functions -----------------------
 ###########################################################################
 def authenticate(api_type):
-    creds = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    if api_type == 'GoogleCalendar':
-        return build('calendar', 'v3', credentials=creds)
-    raise ValueError("Unsupported API type")
+    if api_type != 'GoogleCalendar':
+        raise ValueError("Unsupported API type")
+    # Reuses the cached credentials and service instead of rebuilding per call
+    return get_service(api_type, TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
+
+calendar_mirror = CalendarMirror(CALENDAR_MIRROR_FILE, lambda: authenticate("GoogleCalendar"))
 
 ########################################################################
-# Get calendar events
+# Sync the calendar mirror
 ########################################################################
-def get_calendar_events():
-    service = authenticate("GoogleCalendar")
-    now = datetime.utcnow().isoformat() + 'Z'
-    end = (datetime.utcnow() + timedelta(days=90)).isoformat() + 'Z'
-    events_result = service.events().list(calendarId='primary', timeMin=now, timeMax=end, singleEvents=True, orderBy='startTime').execute()
-    events = events_result.get('items', [])
-    if not events:
-        return "No upcoming events found."
-    text = ""
+# Writes call it with force=True, so the change is read back at once.
+def sync_calendar_mirror(force=False):
+    changed, full = calendar_mirror.sync() if force else calendar_mirror.ensure_synced(CALENDAR_MIRROR_MAX_AGE)
+    if changed or full:
+        logger('INFO', f"Calendar mirror synced: {changed} event(s) {'loaded' if full else 'changed'}.")
+
+########################################################################
+# Upcoming events from the mirror
+########################################################################
+def get_upcoming_events(title=None, days=90):
+    return list(iter_upcoming_events(title, days))
+
+def iter_upcoming_events(title=None, days=90):
+    sync_calendar_mirror()
+    now = datetime.now(timezone.utc)
+    return calendar_mirror.iter_events(now, now + timedelta(days=days), title)
+
+########################################################################
+# Format events for the system prompt within a budget
+########################################################################
+# Events are formatted one at a time and joined once. When the next event
+# would exceed max_chars or max_tokens (0 = no limit), the rest is only
+# counted and summarized per month, so the prompt stays bounded.
+def format_calendar_events(events, max_chars=None, max_tokens=None):
+    max_chars = CALENDAR_PROMPT_MAX_CHARS if max_chars is None else max_chars
+    max_tokens = CALENDAR_PROMPT_MAX_TOKENS if max_tokens is None else max_tokens
+    # Room kept for the summary line
+    reserve = 300
+
+    parts = []
+    chars = 0
+    tokens = 0
+    skipped = 0
+    months = {}
+    first_skipped = last_skipped = None
     for e in events:
         start = e['start'].get('dateTime', e['start'].get('date'))
         end = e['end'].get('dateTime', e['end'].get('date'))
-        text += f"Event: {e.get('summary', 'No title')}\nStart: {start}\nEnd: {end}\nLocation: {e.get('location', 'None')}\nDescription: {e.get('description', 'None')}\n---\n"
-    return text
+        if not skipped:
+            part = f"Event: {e.get('summary', 'No title')}\nStart: {start}\nEnd: {end}\nLocation: {e.get('location', 'None')}\nDescription: {e.get('description', 'None')}\n---\n"
+            part_tokens = count_tokens(part, MODEL) if max_tokens else 0
+            if (not max_chars or chars + len(part) + reserve <= max_chars) and \
+               (not max_tokens or tokens + part_tokens + reserve // 4 <= max_tokens):
+                parts.append(part)
+                chars += len(part)
+                tokens += part_tokens
+                continue
+        skipped += 1
+        months[start[:7]] = months.get(start[:7], 0) + 1
+        first_skipped = first_skipped or start
+        last_skipped = start
+
+    if not parts and not skipped:
+        return "No upcoming events found."
+    if skipped:
+        per_month = ", ".join(f"{month}: {count}" for month, count in months.items())
+        parts.append(
+            f"... {skipped} more event(s) from {first_skipped[:10]} to {last_skipped[:10]} are not listed "
+            f"to keep this prompt short ({per_month}).\n"
+        )
+    return "".join(parts)
+
+########################################################################
+# Get calendar events
+########################################################################
+def get_calendar_events():
+    return format_calendar_events(iter_upcoming_events())
 
 ########################################################################
 # Refresh system message
@@ -166,6 +229,7 @@ def create_calendar_event(title, start_time, end_time, description="", location=
         'attendees': attendee_list,
     }
     created = service.events().insert(calendarId='primary', body=event).execute()
+    sync_calendar_mirror(force=True)
     return f"✅ Event '{title}' created from {start_time} to {end_time}."
 
 ########################################################################
@@ -173,15 +237,14 @@ def create_calendar_event(title, start_time, end_time, description="", location=
 ########################################################################
 def cancel_calendar_event(event_title, start_time=None):
     service = authenticate("GoogleCalendar")
-    now = datetime.utcnow().isoformat() + 'Z'
-    end = (datetime.utcnow() + timedelta(days=90)).isoformat() + 'Z'
-    events = service.events().list(calendarId='primary', timeMin=now, timeMax=end, q=event_title, singleEvents=True).execute().get('items', [])
+    events = get_upcoming_events(event_title)
     if not events:
         return f"⚠️ No event found with title '{event_title}'."
     for e in events:
         event_start = e['start'].get('dateTime', e['start'].get('date'))
         if not start_time or event_start.startswith(start_time[:10]):
             service.events().delete(calendarId='primary', eventId=e['id']).execute()
+            sync_calendar_mirror(force=True)
             return f"❌ Event '{event_title}' on {event_start} canceled."
     return f"⚠️ No exact match found for '{event_title}' on '{start_time}'."
 
@@ -190,9 +253,7 @@ def cancel_calendar_event(event_title, start_time=None):
 ########################################################################
 def modify_calendar_event(event_title, new_title=None, new_start=None, new_end=None, new_description=None, new_location=None):
     service = authenticate("GoogleCalendar")
-    now = datetime.utcnow().isoformat() + 'Z'
-    end = (datetime.utcnow() + timedelta(days=90)).isoformat() + 'Z'
-    events = service.events().list(calendarId='primary', timeMin=now, timeMax=end, q=event_title, singleEvents=True).execute().get('items', [])
+    events = get_upcoming_events(event_title)
     if not events:
         return f"⚠️ No event found for '{event_title}'."
     event = events[0]
@@ -202,6 +263,7 @@ def modify_calendar_event(event_title, new_title=None, new_start=None, new_end=N
     if new_description: event['description'] = new_description
     if new_location: event['location'] = new_location
     service.events().update(calendarId='primary', eventId=event['id'], body=event).execute()
+    sync_calendar_mirror(force=True)
     return f"🔁 Event '{event_title}' updated."
 
 ########################################################################
@@ -209,10 +271,7 @@ def modify_calendar_event(event_title, new_title=None, new_start=None, new_end=N
 ########################################################################
 def respond_to_event(event_title, response):
     service = authenticate("GoogleCalendar")
-    now = datetime.utcnow().isoformat() + "Z"
-    future = (datetime.utcnow() + timedelta(days=90)).isoformat() + "Z"
-    events = service.events().list(calendarId='primary', timeMin=now, timeMax=future).execute().get('items', [])
-    for event in events:
+    for event in get_upcoming_events(event_title):
         if event_title.lower() in event.get("summary", "").lower():
             if "attendees" not in event: return "⚠️ No attendees to respond to."
             for attendee in event["attendees"]:
@@ -220,6 +279,7 @@ def respond_to_event(event_title, response):
                     attendee["responseStatus"] = response
                     break
             service.events().patch(calendarId='primary', eventId=event["id"], body={"attendees": event["attendees"]}).execute()
+            sync_calendar_mirror(force=True)
             return f"✅ Responded '{response}' to '{event['summary']}'"
     return f"⚠️ Event '{event_title}' not found."
 
@@ -228,10 +288,10 @@ def respond_to_event(event_title, response):
 ########################################################################
 def handle_event_result(function_name, args):
     result = globals()[function_name](**args)
-    calendar_text = get_calendar_events()
     title = args.get('title') or args.get('event_title', 'Untitled')
     start_time = args.get('start_time') or args.get('new_start', '')
-    verified = verify_event_in_calendar(title, start_time, calendar_text)
+    # Checked against the mirror, which the call above synced, not the prompt text
+    verified = verify_event_in_events(title, start_time, get_upcoming_events(title))
     result += "\n✅ Verified on calendar." if verified else "\n⚠️ Could not verify calendar change."
     log_feedback(function_name, "verified" if verified else "not_verified", context=str(args))
     result += "\n\nDid that work as expected? (yes / no / suggestion)"
@@ -403,6 +463,7 @@ def handle_feedback(feedback_choice, feedback_state, history):
     return history, feedback_state, gr.update(visible=False)
 
 def handle_refresh(history):
+    sync_calendar_mirror(force=True)
     refresh_system_message()
     history.append(["", "✅ Calendar successfully refreshed."])
     return history
@@ -6,6 +6,14 @@ FEEDBACK_LOG = "feedback_log.jsonl"
 def verify_event_in_calendar(event_title, start_time, calendar_text):
     return event_title.lower() in calendar_text.lower() and start_time[:10] in calendar_text
 
+def verify_event_in_events(event_title, start_time, events):
+    for event in events:
+        start = event.get("start", {})
+        start = start.get("dateTime") or start.get("date") or ""
+        if event_title.lower() in event.get("summary", "").lower() and start.startswith(start_time[:10]):
+            return True
+    return False
+
 def log_feedback(action, result, user_input=None, context=""):
     feedback_entry = {
         "timestamp": datetime.now().isoformat(),
@@ -1,14 +1,18 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
-import ollama
+from openai import OpenAI, BadRequestError
 import json
-import re
 from datetime import datetime, timedelta
 import time
-import asyncio
-from telegram_get_chats import telegram_get_chats
-from google_email_calendar_libs import google_calendar_event_creater, gmail_with_attachments_reader, logger
+import random
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from source_connectors import get_connector, get_connectors
+from extraction_cache import ExtractionCache
+from message_prefilter import MessagePrefilter
+from ics_parser import ics_to_google_events
+from event_schema import EVENTS_RESPONSE_FORMAT, validate_event, parse_events_reply
+from token_counter import count_tokens
+from google_email_calendar_libs import google_calendar_bulk_event_creater, logger, write_atomic
 
 ################################
 #LOAD ENVIRONMENT VARIABLES
@@ -56,44 +60,105 @@ except (ValueError, TypeError):
     print("Invalid value for NO_OF_DAYS_TO_LOOK_BACK. Defaulting to 7 days.")
     NO_OF_DAYS_TO_LOOK_BACK = 7
 
-#get data source details
-INCLUDE_GMAIL = os.getenv('INCLUDE_GMAIL')
-if not INCLUDE_GMAIL:
-    # If INCLUDE_GMAIL is not set, use the default value
-    # This is useful for testing in a local environment
-    # or if the environment variable is not set
-    INCLUDE_GMAIL = "True"
-    print("INCLUDE_GMAIL not defined in the environment file. Using default value.")
+#get number of cycles a failed window is retried before it is committed anyway
+CHECKPOINT_MAX_ATTEMPTS = os.getenv('CHECKPOINT_MAX_ATTEMPTS')
+try:
+    CHECKPOINT_MAX_ATTEMPTS = max(1, int(CHECKPOINT_MAX_ATTEMPTS))
+except (ValueError, TypeError):
+    CHECKPOINT_MAX_ATTEMPTS = 3
 
-INCLUDE_TELEGRAM = os.getenv('INCLUDE_TELEGRAM')
-if not INCLUDE_TELEGRAM:
-    # If INCLUDE_TELEGRAM is not set, use the default value
-    # This is useful for testing in a local environment
-    # or if the environment variable is not set
-    INCLUDE_TELEGRAM = "True"
-    print("INCLUDE_TELEGRAM not defined in the environment file. Using default value.")
+#get the token budget of the source data sent in one LLM request
+LLM_CHUNK_TOKEN_BUDGET = os.getenv('LLM_CHUNK_TOKEN_BUDGET')
+try:
+    LLM_CHUNK_TOKEN_BUDGET = max(1, int(LLM_CHUNK_TOKEN_BUDGET))
+except (ValueError, TypeError):
+    LLM_CHUNK_TOKEN_BUDGET = 12000
+
+#get the number of LLM requests sent at the same time
+LLM_MAX_WORKERS = os.getenv('LLM_MAX_WORKERS')
+try:
+    LLM_MAX_WORKERS = max(1, int(LLM_MAX_WORKERS))
+except (ValueError, TypeError):
+    LLM_MAX_WORKERS = 4
+
+#get the number of times a failed chunk is sent again before the cycle fails
+LLM_CHUNK_RETRIES = os.getenv('LLM_CHUNK_RETRIES')
+try:
+    LLM_CHUNK_RETRIES = max(0, int(LLM_CHUNK_RETRIES))
+except (ValueError, TypeError):
+    LLM_CHUNK_RETRIES = 2
+
+#get whether the LLM is asked for schema constrained (structured) output;
+#models without it are asked for plain JSON replies
+LLM_STRUCTURED_OUTPUT = (os.getenv('LLM_STRUCTURED_OUTPUT') or "True") == "True"
+# Switched off for the process when the model rejects the response format
+structured_output = {"enabled": LLM_STRUCTURED_OUTPUT}
+
+#get the extraction cache file
+EXTRACTION_CACHE_FILE = os.getenv('EXTRACTION_CACHE_FILE')
+if not EXTRACTION_CACHE_FILE:
+    EXTRACTION_CACHE_FILE = os.path.join(DAEMON_DIR, "extraction_cache.sqlite3")
+
+#get the pre-filter settings: messages scoring below the threshold are not
+#sent to the LLM, senders in the lists always / never pass
+PREFILTER_ENABLED = (os.getenv('PREFILTER_ENABLED') or "True") == "True"
+PREFILTER_THRESHOLD = os.getenv('PREFILTER_THRESHOLD')
+try:
+    PREFILTER_THRESHOLD = int(PREFILTER_THRESHOLD)
+except (ValueError, TypeError):
+    PREFILTER_THRESHOLD = 2
+PREFILTER_ALLOW_SENDERS = (os.getenv('PREFILTER_ALLOW_SENDERS') or "").split(",")
+PREFILTER_DENY_SENDERS = (os.getenv('PREFILTER_DENY_SENDERS') or "").split(",")
+
+prefilter = MessagePrefilter(PREFILTER_THRESHOLD, PREFILTER_ALLOW_SENDERS, PREFILTER_DENY_SENDERS)
+
+#get the time zone of invite times without one, local time when not set
+ICS_DEFAULT_TIMEZONE = os.getenv('ICS_DEFAULT_TIMEZONE') or None
+
+# Part of the extraction cache key. Change it when the prompts change, so
+# messages are extracted again with the new prompts.
+PROMPT_VERSION = "2"
+
+# Every source is fetched in its own worker thread
+source_executor = ThreadPoolExecutor(thread_name_prefix="source-fetch")
+# Last fetch submitted per source. A fetch that timed out keeps running, and
+# the source is not fetched again until it has finished.
+source_fetches = {}
+
+###########################################################
+# Function to get the checkpoint file of a source
+# ###########################################################
+# e.g. daemon_google_calendar_event_creater.gmail.ts next to TS_FILE
+def get_checkpoint_file(source):
+    stem, ext = os.path.splitext(TS_FILE)
+    return f"{stem}.{source}{ext or '.ts'}"
+
+def read_last_read_time(ts_file):
+    if not os.path.exists(ts_file):
+        return None
+    with open(ts_file, "r") as f:
+        lines = f.readlines()
+    if not lines:
+        return None
+    last_read_time_str = lines[0].strip().split(":", 1)[1]
+    return datetime.strptime(last_read_time_str, "%Y-%m-%d %H:%M:%S.%f")
 
 ###########################################################
-# Function to get the time window for fetching emails and telegram messages
+# Function to get the time window for fetching the data of a source
 # ###########################################################
-def get_time_window():
-        # Check if the timestamp file exists
-    if os.path.exists(TS_FILE):
-        with open(TS_FILE, "r") as f:
-            lines = f.readlines()
-        if lines:
-            last_read_time_str = lines[0].strip().split(":", 1)[1]
-            last_read_time = datetime.strptime(last_read_time_str, "%Y-%m-%d %H:%M:%S.%f")
-            logger('INFO',f"Last read time: {last_read_time}")
-        else:
-            # Empty file, use default
-            last_read_time = (datetime.now() - timedelta(days=NO_OF_DAYS_TO_LOOK_BACK))
-            logger('INFO',f"Timestamp file is empty. Defaulting last read time to: {last_read_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
+def get_time_window(source):
+    last_read_time = read_last_read_time(get_checkpoint_file(source))
+    if last_read_time is None:
+        # Continue from the shared timestamp file written before sources had their own
+        last_read_time = read_last_read_time(TS_FILE)
+
+    if last_read_time is not None:
+        logger('INFO',f"Last read time of {source}: {last_read_time}")
     else:
-        # File not found, use default
+        # File not found or empty, use default
         last_read_time = (datetime.now() - timedelta(days=NO_OF_DAYS_TO_LOOK_BACK))
-        logger('INFO',f"Timestamp file not found. Defaulting last read time to: {last_read_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")              
-    
+        logger('INFO',f"No timestamp for {source}. Defaulting last read time to: {last_read_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}")
+
     # for gmail api the start time and end time should be in epoch format
     after_ts = int(time.mktime(last_read_time.timetuple()))
     before_ts = int(time.mktime(datetime.now().timetuple()))
@@ -101,20 +166,52 @@ def get_time_window():
     # Convert epoch time to human-readable format for debugging
     after_ts_human_readable = datetime.fromtimestamp(after_ts).strftime('%Y-%m-%d %H:%M:%S')
     before_ts_human_readable = datetime.fromtimestamp(before_ts).strftime('%Y-%m-%d %H:%M:%S')
-    logger('INFO', f"Fetching emails from {after_ts_human_readable} to {before_ts_human_readable}")
-
-    # Create or overwrite the timestamp file
-    with open(TS_FILE, "w") as f: 
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        f.write(f"LAST_READ_TIME:{timestamp}")
+    logger('INFO', f"Fetching {source} from {after_ts_human_readable} to {before_ts_human_readable}")
 
     return after_ts, before_ts
 #end
 
 ###########################################################
-# Function to check Gmail and create calendar events
+# Two-phase checkpoint of a source
 # ###########################################################
-def ai_agent_create_calendar_event():
+# Once a window has been fetched it is recorded as pending, together with
+# the fetched records and the source state, in <checkpoint>.pending.json.
+# The checkpoint only advances when the window is committed after its events
+# were created. A window whose processing failed stays pending and its
+# cached records are processed again on the next cycle without refetching.
+def get_pending_file(source):
+    return get_checkpoint_file(source) + ".pending.json"
+
+def read_pending_window(source):
+    pending_file = get_pending_file(source)
+    if not os.path.exists(pending_file):
+        return None
+    try:
+        with open(pending_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (ValueError, OSError) as e:
+        logger('INFO', f"Pending window of {source} is unreadable, fetching it again: {e}")
+        return None
+
+def write_pending_window(source, pending):
+    write_atomic(get_pending_file(source), json.dumps(pending))
+
+###########################################################
+# Function to commit a processed window of a source
+# ###########################################################
+def commit_window(connector, pending):
+    # Source state first: if the checkpoint write is lost, the window is
+    # processed again and the calendar duplicate check skips its events
+    connector.commit(pending["state"])
+    timestamp = datetime.fromtimestamp(pending["before_ts"]).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    write_atomic(get_checkpoint_file(connector.name), f"LAST_READ_TIME:{timestamp}")
+    os.remove(get_pending_file(connector.name))
+#end
+
+###########################################################
+# Function to get the LLM model to use
+# ###########################################################
+def get_llm_model():
 
   # Load environment variables
   load_dotenv(override=True)
@@ -132,9 +229,16 @@ def ai_agent_create_calendar_event():
   else:
       logger('INFO', "There might be a problem with your API key? Please visit the troubleshooting notebook!")
 
+  return MODEL
+#end
 
-  # Get the time window for fetching emails and telegram messages
-  after_ts, before_ts = get_time_window()
+###########################################################
+# Function to build the prompts for the given source data
+# ###########################################################
+# sources is a list of (connector, formatted data) pairs. With tagged=True
+# every message starts with a [#n] tag and the LLM is asked to tell which
+# messages each appointment was found in.
+def build_prompts(sources, tagged=False):
 
   current_time = datetime.now()
   formatted_time = current_time.strftime("%A, %B %d, %Y (%Y-%m-%dT%H:%M:%S%z)")
@@ -152,31 +256,15 @@ def ai_agent_create_calendar_event():
   "day" starts at 00:00 and ends at 23:59.
   """
 
-  #if email data to be included
-  if INCLUDE_GMAIL == "True":    
-    system_prompt += """
-    You are a personal assistant who can check my emails, identify any appointments and create them in my google calendar.
-    """
-    #if email data to be included
-    user_prompt += """
-    Pls identify appointments based on the email data and email attachements given below.
-    """
-  
-  #if telegram data to be included
-  if INCLUDE_TELEGRAM == "True":
-    system_prompt += """
-    You are a personal assistant who can check my telegram messages, identify any appointments and create them in my google calendar.
-    Attendees is not required for Telegram messages.
-    """
-    user_prompt += """
-    Pls identify appointments based on the telegram chat messages data given below.
-    """
+  for connector, data in sources:
+    system_prompt += connector.system_prompt
+    user_prompt += connector.user_prompt
 
   user_prompt += """
   Consider 12:30 PM as my lunch time and 7:00 PM as my dinner time.
   Give my appointment details in the format that is needed to create event in my google calendar.
-  Use the below JSON format and create a list of dictionaries.
-  Only output the JSON content, and make sure it's valid.
+  Only output a JSON object {"events": [...]} with the list of appointments, and make sure it's valid.
+  Use the below JSON format for each appointment, with null for unknown location or description.
   {
     "summary": "Appointment Title",
     "location": "Location",
@@ -203,69 +291,494 @@ def ai_agent_create_calendar_event():
   The appointment details should be in the above format.
   """
 
-  #if email data to be included
-  if INCLUDE_GMAIL == "True":
-    user_prompt += """
-    For any attachments, parse the attachment and consider if there are any appointments in the attachment image or any other format.
-    If the attachment contains a flight, train, or bus ticket, extract the relevant travel details and convert them into a 
-    calendar appointment. Use the departure and arrival dates and times from the ticket to set the appointment duration. 
-    Include the origin and destination in the appointment title or description. Add the list of passengers (if available) 
-    to the appointment body.
-    If there are any appointments in the attachment, include them in the above format.
-    Here are my emails and email attachement details: \n
-    """ 
-    user_prompt += gmail_with_attachments_reader(after_ts, before_ts)
-
-  #if telegram data to be included
-  if INCLUDE_TELEGRAM == "True":
+  if tagged:
     user_prompt += """
-    Here are my messages details from Telegram: \n
-    """
-    user_prompt += asyncio.run(telegram_get_chats(after_ts, before_ts))
+  Every message below starts with a tag such as [#1].
+  Add a "source" field to each appointment with the list of tags of the messages it was found in, e.g. "source": ["#1"].
+  """
+
+  for connector, data in sources:
+    user_prompt += connector.data_prompt
+    user_prompt += data
+
+  return system_prompt, user_prompt
+#end
+
+###########################################################
+# Function to split the source records into token-budgeted chunks
+# ###########################################################
+# sources is a list of (connector, records). Records are packed in order into
+# chunks of at most budget (LLM_CHUNK_TOKEN_BUDGET) tokens of source data; a
+# record larger than the budget gets a chunk of its own. Each chunk is a list
+# of (connector, records) where the records are copies whose text starts with
+# the [#n] tag of the record in its chunk.
+def chunk_sources(sources, MODEL, budget=None):
+
+  budget = budget or LLM_CHUNK_TOKEN_BUDGET
+  chunks = []
+  current = []
+  used = 0
+  for connector, records in sources:
+    for record in records:
+      tokens = count_tokens(record["text"], MODEL)
+      if current and used + tokens > budget:
+        chunks.append(current)
+        current = []
+        used = 0
+      tag = f"#{sum(len(chunk_records) for _, chunk_records in current) + 1}"
+      record = dict(record, tag=tag, text=f"[{tag}]\n{record['text']}")
+      if current and current[-1][0] is connector:
+        current[-1][1].append(record)
+      else:
+        current.append((connector, [record]))
+      used += tokens
+  if current:
+    chunks.append(current)
+  return chunks
+#end
 
+###########################################################
+# Function to extract appointments with the LLM
+# ###########################################################
+# Returns the list of valid events found in the LLM answer. The model is
+# asked for structured output following EVENTS_RESPONSE_FORMAT; each event is
+# checked with validate_event() and a bad one is dropped without the others.
+# Raises ValueError when the answer cannot be parsed.
+def extract_events(system_prompt, user_prompt, MODEL):
 
   openai = OpenAI()
+  messages = [
+    {"role": "system", "content": system_prompt},
+    {"role": "user", "content": user_prompt},
+  ]
 
   # Verson without streaming results
-  response = openai.chat.completions.create(
-          model=MODEL,
-          messages=[
-              {"role": "system", "content": system_prompt},
-              {"role": "user", "content": user_prompt},
-            ]
-      )
-  result = response.choices[0].message.content
+  response = None
+  if structured_output["enabled"]:
+    try:
+      response = openai.chat.completions.create(model=MODEL, messages=messages, response_format=EVENTS_RESPONSE_FORMAT)
+    except BadRequestError as e:
+      if "response_format" not in str(e) and "json_schema" not in str(e):
+        raise
+      logger('INFO', f"{MODEL} does not support structured output, using plain JSON replies: {e}")
+      structured_output["enabled"] = False
+  if response is None:
+    response = openai.chat.completions.create(model=MODEL, messages=messages)
+
+  message = response.choices[0].message
+  if getattr(message, "refusal", None):
+    logger('INFO', f"The LLM refused the request: {message.refusal}")
+    return []
+  result = message.content
   logger('DEBUG', result)
 
-  if not result.strip():
+  if not result or not result.strip():
     logger('INFO', "The result is empty. No events to process.")
-    return
-  
-  else:
-  
-    # Extract all JSON blocks from the result
-    events = re.findall(r"```json(.*?)```", result, re.DOTALL)
+    return []
+
+  events = []
+  for i, event in enumerate(parse_events_reply(result), 1):
+    valid_event, error = validate_event(event)
+    if error:
+      logger('INFO', f"Rejected event {i} of the LLM answer: {error}: {json.dumps(event)[:500]}")
+      continue
+    events.append(valid_event)
+  return events
+#end
+
+###########################################################
+# Function to extract the appointments of one chunk
+# ###########################################################
+# A failed request or unparsable answer is sent again up to LLM_CHUNK_RETRIES
+# times with backoff, so only the failed chunk is repeated.
+def extract_chunk_events(system_prompt, user_prompt, MODEL):
+
+  for attempt in range(LLM_CHUNK_RETRIES + 1):
+    try:
+      return extract_events(system_prompt, user_prompt, MODEL)
+    except Exception as e:
+      if attempt == LLM_CHUNK_RETRIES:
+        raise
+      delay = 2 ** attempt + random.random()
+      logger('INFO', f"Chunk extraction failed ({e}), retrying in {delay:.1f} seconds")
+      time.sleep(delay)
+#end
+
+###########################################################
+# Function to get the extraction cache
+# ###########################################################
+_extraction_cache = {"cache": None}
+
+def get_extraction_cache():
+  if _extraction_cache["cache"] is None:
+    _extraction_cache["cache"] = ExtractionCache(EXTRACTION_CACHE_FILE)
+  return _extraction_cache["cache"]
+#end
+
+###########################################################
+# Function to take meeting invites out of the LLM path
+# ###########################################################
+# Records carrying iCalendar data (inline text/calendar parts, .ics
+# attachments) are converted by the ICS parser. Returns the remaining
+# sources and the events read from the invites.
+def extract_invite_events(sources):
+
+  remaining = []
+  events = []
+  for connector, records in sources:
+    kept = []
+    for record in records:
+      invite_events = parse_invites(record)
+      if invite_events is None:
+        kept.append(record)
+      else:
+        events.extend(invite_events)
+    if kept:
+      remaining.append((connector, kept))
+  return remaining, events
+#end
+
+# Returns the events of the invites of a record, or None when the record has
+# no usable invite and has to go to the LLM
+def parse_invites(record):
+  if not record.get("calendar_data"):
+    return None
+
+  events = []
+  skipped = []
+  try:
+    for text in record["calendar_data"]:
+      found, not_created = ics_to_google_events(text, ICS_DEFAULT_TIMEZONE)
+      events.extend(found)
+      skipped.extend(not_created)
+  except Exception as e:
+    logger('INFO', f"Could not parse the invite in {record['id']}: {e}. Using the LLM instead.")
+    return None
+
+  if not events and not skipped:
+    return None
+  logger('INFO', f"{len(events)} event(s) read from the invite in {record['id']}, {len(skipped)} skipped")
+  for reason in skipped:
+    logger('INFO', f"Skipped an event of the invite in {record['id']}: {reason}")
+  return events
+#end
+
+###########################################################
+# Function to drop the records without scheduling signal
+# ###########################################################
+def prefilter_sources(sources, MODEL):
+
+  filtered = []
+  dropped_records = []
+  for connector, records in sources:
+    kept, dropped = prefilter.filter(records)
+    dropped_records.extend(dropped)
+    if kept:
+      filtered.append((connector, kept))
+
+  if dropped_records:
+    saved_tokens = sum(count_tokens(record["text"], MODEL) for record in dropped_records)
+    total = sum(len(records) for _, records in sources)
+    logger('INFO', f"Pre-filter dropped {len(dropped_records)} of {total} record(s), saving about {saved_tokens} prompt tokens")
+  return filtered
+#end
+
+###########################################################
+# Function to extract appointments from the records of the sources
+# ###########################################################
+# Meeting invites are read by the ICS parser and records without scheduling
+# signal are dropped by the pre-filter. The events of records extracted before with the same model and prompt version come
+# from the extraction cache; only the other records are sent to the LLM.
+# Returns the merged and deduplicated events.
+def extract_events_from_sources(sources, MODEL):
+
+  sources, invite_events = extract_invite_events(sources)
+  if PREFILTER_ENABLED:
+    sources = prefilter_sources(sources, MODEL)
+
+  cache = get_extraction_cache()
+  entries = [
+    (connector, record, ExtractionCache.make_key(connector.name, record["text"], MODEL, PROMPT_VERSION))
+    for connector, records in sources for record in records
+  ]
+  cached = cache.get_many(key for _, _, key in entries)
+
+  events = invite_events
+  missing_sources = []
+  for connector, record, key in entries:
+    if key in cached:
+      events.extend(cached[key])
+      continue
+    record = dict(record, cache_key=key)
+    if missing_sources and missing_sources[-1][0] is connector:
+      missing_sources[-1][1].append(record)
+    else:
+      missing_sources.append((connector, [record]))
+  logger('INFO', f"{len(entries) - sum(len(records) for _, records in missing_sources)} of {len(entries)} record(s) found in the extraction cache")
+
+  if missing_sources:
+    chunks = chunk_sources(missing_sources, MODEL)
+    logger('INFO', f"Extracting appointments from {sum(len(records) for _, records in missing_sources)} record(s) in {len(chunks)} chunk(s)")
+    events.extend(extract_events_from_chunks(chunks, MODEL))
+
+  return dedupe_events(events)
+#end
 
-    # Check if events list is empty
-    if not events:
-        logger('INFO', "No JSON-formatted events found in the email content.")
-        return  # Exit the function gracefully
+###########################################################
+# Function to extract appointments from chunks concurrently
+# ###########################################################
+# At most LLM_MAX_WORKERS chunks are sent at the same time. The events of
+# each chunk are stored in the extraction cache per record, using the source
+# tags returned by the LLM. A chunk still failing after its retries fails the
+# extraction, after the chunks that succeeded are cached, so the next cycle
+# only sends the failed chunk again.
+def extract_events_from_chunks(chunks, MODEL):
 
-    # Extract the actual JSON string (since it's inside a list)
+  prompts = [
+    build_prompts([(connector, connector.format_records(records)) for connector, records in chunk], tagged=True)
+    for chunk in chunks
+  ]
+  with ThreadPoolExecutor(max_workers=min(LLM_MAX_WORKERS, len(prompts)), thread_name_prefix="llm") as executor:
+    futures = [executor.submit(extract_chunk_events, system_prompt, user_prompt, MODEL) for system_prompt, user_prompt in prompts]
+
+  events = []
+  cache_entries = {}
+  errors = []
+  for chunk, future in zip(chunks, futures):
     try:
-        json_string = events[0]  # Get the first element, which is the JSON string
-        logger('DEBUG',f"Extracted JSON string: {json_string}")
-        json_events = json.loads(json_string)  # Convert the string into a Python list of dictionaries
-    except (IndexError, json.JSONDecodeError) as e:
-        logger('INFO', f"Error processing events: {e}")
-        return  # Exit the function gracefully
-
-    # Process the events
-    for i, event in enumerate(json_events, start=1):
-        try:
-            # Invoke Google Calendar API to create event
-            logger('DEBUG',f"Creating event {i}: {event}")
-            google_calendar_event_creater(event)
-        except Exception as e:
-            logger('INFO', f"Error creating event {i}: {e}")
-#end
\ No newline at end of file
+      chunk_events = future.result()
+    except Exception as e:
+      errors.append(e)
+      continue
+    cache_entries.update(attribute_events(chunk, chunk_events))
+    events.extend(chunk_events)
+  if cache_entries:
+    get_extraction_cache().put_many(cache_entries)
+  if errors:
+    logger('INFO', f"Extraction failed for {len(errors)} of {len(chunks)} chunks")
+    raise errors[0]
+  return events
+#end
+
+###########################################################
+# Function to assign the events of a chunk to its records
+# ###########################################################
+# Removes the "source" tags from the events and returns {cache key: events}
+# for every record of the chunk, records without appointments getting an
+# empty list. When an event cannot be attributed nothing is returned, so
+# the chunk is not cached.
+def attribute_events(chunk, events):
+
+  by_tag = {record["tag"]: [] for _, records in chunk for record in records}
+  complete = True
+  for event in events:
+    tags = [tag for tag in pop_event_tags(event) if tag in by_tag] if isinstance(event, dict) else []
+    if not tags:
+      complete = False
+      continue
+    for tag in tags:
+      by_tag[tag].append(event)
+
+  if not complete:
+    logger('INFO', "Some events could not be matched to their messages. Not caching this chunk.")
+    return {}
+  return {record["cache_key"]: by_tag[record["tag"]] for _, records in chunk for record in records}
+#end
+
+def pop_event_tags(event):
+  source = event.get("source")
+  # A dict is the calendar "source" field of the event itself
+  if source is None or isinstance(source, dict):
+    return []
+  del event["source"]
+  if not isinstance(source, list):
+    source = [source]
+  tags = []
+  for value in source:
+    value = str(value).strip().strip("[]").strip()
+    tags.append(value if value.startswith("#") else f"#{value}")
+  return tags
+#end
+
+###########################################################
+# Function to drop events found more than once
+# ###########################################################
+# The same appointment can be found in several chunks, e.g. a confirmation
+# mail and a Telegram message about it. Events with the same title and start
+# are kept once.
+def dedupe_events(events):
+  seen = set()
+  unique = []
+  for event in events:
+    if isinstance(event, dict):
+      start = event.get("start") or {}
+      if not isinstance(start, dict):
+        start = {}
+      key = (
+        " ".join(str(event.get("summary") or "").lower().split()),
+        start.get("dateTime") or start.get("date"),
+      )
+      if key in seen:
+        logger('DEBUG', f"Skipping duplicate event: {event.get('summary')}")
+        continue
+      seen.add(key)
+    unique.append(event)
+  return unique
+#end
+
+###########################################################
+# Function to create the extracted events in the calendar
+# ###########################################################
+def create_events(events):
+
+  for event in events:
+      # Drop a message tag the LLM added outside of a tagged prompt
+      if isinstance(event, dict) and not isinstance(event.get("source", {}), dict):
+          del event["source"]
+  if not events:
+      return 0
+
+  # Invoke Google Calendar API to create the events in one batch
+  logger('DEBUG', f"Creating {len(events)} event(s): {events}")
+  results = google_calendar_bulk_event_creater(events)
+
+  created = 0
+  failed = 0
+  for i, result in enumerate(results, start=1):
+      if isinstance(result, Exception):
+          failed += 1
+          logger('INFO', f"Error creating event {i}: {result}")
+      elif result:
+          created += 1
+
+  # Let the caller keep the window, the events created meanwhile are
+  # skipped as duplicates when it is processed again
+  if failed:
+      raise RuntimeError(f"{failed} of {len(events)} event(s) could not be created ({created} created)")
+  return created
+#end
+
+###########################################################
+# Function to extract appointments with the LLM and create them
+# ###########################################################
+def extract_and_create_events(system_prompt, user_prompt, MODEL):
+  return create_events(extract_events(system_prompt, user_prompt, MODEL))
+#end
+
+###########################################################
+# Function to fetch the enabled sources concurrently
+# ###########################################################
+# Returns (fetched, failed): fetched lists (connector, pending window) for
+# the sources that have records to process, failed maps the name of each
+# source that failed, timed out or is still busy with an earlier fetch to
+# the reason. Sources with a pending window from a failed cycle reuse its
+# records; the others are fetched and recorded as pending. A failed source
+# is left out, so its window is read again on the next cycle while the
+# other sources move on.
+def fetch_sources(connectors):
+
+  started = time.monotonic()
+  fetched = []
+  failed = {}
+  futures = []
+  for connector in connectors:
+    pending = read_pending_window(connector.name)
+    if pending is not None:
+      pending["attempts"] += 1
+      write_pending_window(connector.name, pending)
+      logger('INFO', f"Retrying pending {connector.name} window with {len(pending['records'])} record(s), attempt {pending['attempts']}")
+      fetched.append((connector, pending))
+      continue
+
+    previous = source_fetches.get(connector.name)
+    if previous is not None and not previous.done():
+      # Two fetches of a source would share its state, e.g. the attachment store
+      logger('INFO', f"{connector.name} fetch of an earlier cycle is still running. Skipping it this cycle.")
+      failed[connector.name] = "an earlier fetch is still running"
+      continue
+
+    after_ts, before_ts = get_time_window(connector.name)
+    pending = {"after_ts": after_ts, "before_ts": before_ts, "records": None, "state": {}, "attempts": 1}
+    future = source_executor.submit(connector.fetch, after_ts, before_ts, pending["state"])
+    source_fetches[connector.name] = future
+    futures.append((connector, pending, future))
+
+  for connector, pending, future in futures:
+    timeout = connector.settings["fetch_timeout"] - (time.monotonic() - started)
+    records, error = get_source_result(connector.name, future, timeout)
+    if error is not None:
+      failed[connector.name] = error
+      continue
+    logger('INFO', f"{len(records)} record(s) fetched from {connector.name}")
+    pending["records"] = records
+    write_pending_window(connector.name, pending)
+    fetched.append((connector, pending))
+  logger('INFO', f"Sources fetched in {time.monotonic() - started:.1f}s")
+
+  return fetched, failed
+#end
+
+# Returns (records, None), or (None, reason) when the fetch failed
+def get_source_result(source, future, timeout):
+  try:
+    # Telegram enforces its timeout on the event loop, the margin only covers the hand-over
+    return future.result(max(0, timeout) + 10), None
+  except FutureTimeoutError:
+    logger('INFO', f"{source} fetch timed out. Continuing without it.")
+    return None, "fetch timed out"
+  except Exception as e:
+    logger('INFO', f"{source} fetch failed: {e}. Continuing without it.")
+    return None, f"fetch failed: {e}"
+#end
+
+###########################################################
+# Function to check the enabled sources and create calendar events
+# ###########################################################
+# Returns the number of events created. Raises when a source could not be
+# fetched, after the other sources are processed, so the daemon backs off.
+def ai_agent_create_calendar_event():
+
+  MODEL = get_llm_model()
+
+  connectors = get_connectors(polled_only=True)
+  if not connectors:
+    logger('INFO', "No data source to poll.")
+    return 0
+
+  fetched, failed = fetch_sources(connectors)
+  sources = [(connector, pending["records"]) for connector, pending in fetched if pending["records"]]
+
+  # Number of events created, used by the daemon scheduler
+  created = 0
+  if sources:
+    try:
+      created = create_events(extract_events_from_sources(sources, MODEL))
+    except Exception:
+      # Keep the windows pending for the next cycle, unless they keep failing
+      for connector, pending in fetched:
+        if pending["attempts"] >= CHECKPOINT_MAX_ATTEMPTS:
+          logger('INFO', f"Giving up on the {connector.name} window after {pending['attempts']} attempts.")
+          commit_window(connector, pending)
+      raise
+  else:
+    logger('INFO', "No new messages in any source.")
+
+  for connector, pending in fetched:
+    commit_window(connector, pending)
+
+  # The other sources are processed, but the daemon scheduler backs off
+  if failed:
+    raise RuntimeError(
+      f"{created} event(s) created, source(s) failed: " + "; ".join(f"{name}: {reason}" for name, reason in failed.items())
+    )
+  return created
+#end
+
+###########################################################
+# Function to create calendar events from real-time Telegram messages
+# ###########################################################
+def ai_agent_create_calendar_event_from_telegram(chat_records):
+
+  MODEL = get_llm_model()
+  return create_events(extract_events_from_sources([(get_connector("telegram"), chat_records)], MODEL))
+#end
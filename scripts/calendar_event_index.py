@@ -0,0 +1,83 @@
+##########################################################
+# In-memory interval index of calendar events
+##########################################################
+# Used to find duplicates of new events locally: the existing events of the
+# whole time range are listed once, indexed here by start time, and every new
+# event is checked against the events it overlaps instead of sending one
+# events().list() request per event.
+#
+# Intervals are kept sorted by start; a query only scans the starts between
+# (query start - longest duration) and the query end, found with bisect.
+##########################################################
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, time, timedelta
+
+
+############################################################
+# Start and end of a Google Calendar event as aware datetimes
+############################################################
+# All-day events (date only) and times without an offset are taken as local
+# time, like the rest of the daemon does.
+def event_bounds(event):
+    bounds = []
+    for key in ("start", "end"):
+        value = event[key].get("dateTime") or event[key]["date"]
+        dt = datetime.fromisoformat(value)
+        if len(value) == 10:
+            dt = datetime.combine(dt.date(), time())
+        if dt.tzinfo is None:
+            dt = dt.astimezone()
+        bounds.append(dt)
+    return tuple(bounds)
+
+
+class EventIntervalIndex:
+
+    def __init__(self, events=()):
+        self._intervals = []
+        self._max_duration = timedelta(0)
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    ############################################################
+    # Add an event, returns False when its times cannot be read
+    ############################################################
+    def add(self, event):
+        try:
+            start, end = event_bounds(event)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        # The id keeps the tuples comparable when two events start together
+        insort(self._intervals, (start, end, len(self._intervals), event))
+        self._max_duration = max(self._max_duration, end - start)
+        return True
+
+    ############################################################
+    # Events overlapping [start, end]
+    ############################################################
+    # Same rule as the timeMin / timeMax filter of events().list(), plus
+    # events starting at the same time for zero length queries.
+    def overlapping(self, start, end):
+        starts = _StartView(self._intervals)
+        lo = bisect_left(starts, start - self._max_duration)
+        hi = bisect_right(starts, end)
+        return [
+            event for event_start, event_end, _, event in self._intervals[lo:hi]
+            if (event_start < end and event_end > start) or event_start == start
+        ]
+
+
+class _StartView:
+    # Sequence of the interval starts, for bisect without a copy of the list
+
+    def __init__(self, intervals):
+        self._intervals = intervals
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __getitem__(self, i):
+        return self._intervals[i][0]
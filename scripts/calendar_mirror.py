@@ -0,0 +1,162 @@
+##########################################################
+# Local mirror of the Google Calendar
+##########################################################
+# The chat assistant used to list the next 90 days of events on every
+# refresh, verification and tool call. The mirror keeps a copy of the
+# calendar in SQLite instead, kept current with the incremental sync of the
+# Calendar API:
+#   - the first sync lists every event (all pages) and stores the
+#     nextSyncToken of the last page,
+#   - every later sync sends that syncToken and only receives the events
+#     changed since, cancelled ones included, which are removed,
+#   - when Google expires the token (410 Gone) the mirror is cleared and
+#     fully synced again.
+# Recurring events are expanded (singleEvents), so every instance is a row
+# with its own start and end.
+#
+# Tables:
+#   events(id TEXT PRIMARY KEY, start TEXT, end TEXT, summary TEXT, body TEXT)
+#   state(key TEXT PRIMARY KEY, value TEXT)
+# where start / end are UTC times ("YYYY-MM-DDTHH:MM:SSZ", all-day events at
+# local midnight) used for the range queries and body is the event JSON.
+##########################################################
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import timezone
+from googleapiclient.errors import HttpError
+
+from calendar_event_index import event_bounds
+
+
+def _utc_key(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class CalendarMirror:
+
+    def __init__(self, db_file, service_factory, calendar_id='primary'):
+        self.db_file = db_file
+        self.calendar_id = calendar_id
+        # Called for every sync, returns the Calendar service
+        self.service_factory = service_factory
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # Used from the Gradio worker threads, access is serialized
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS events "
+                "(id TEXT PRIMARY KEY, start TEXT NOT NULL, end TEXT NOT NULL, summary TEXT, body TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS events_start ON events (start)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _get_state(self, key):
+        row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    ############################################################
+    # Bring the mirror up to date
+    ############################################################
+    # Returns (number of changed events, True for a full sync).
+    def sync(self):
+        with self._lock:
+            sync_token = self._get_state("sync_token")
+            try:
+                changed, next_token = self._fetch_changes(sync_token)
+            except HttpError as e:
+                if e.resp.status != 410 or sync_token is None:
+                    raise
+                # The sync token expired, start over
+                sync_token = None
+                changed, next_token = self._fetch_changes(None)
+
+            with self._conn:
+                if sync_token is None:
+                    self._conn.execute("DELETE FROM events")
+                for event in changed:
+                    self._apply(event)
+                self._set_state("sync_token", next_token)
+                self._set_state("synced_at", str(time.time()))
+            return len(changed), sync_token is None
+
+    ############################################################
+    # Sync when the last sync is older than max_age seconds
+    ############################################################
+    def ensure_synced(self, max_age=0):
+        with self._lock:
+            synced_at = self._get_state("synced_at")
+            if synced_at is not None and time.time() - float(synced_at) < max_age:
+                return 0, False
+            return self.sync()
+
+    def _fetch_changes(self, sync_token):
+        service = self.service_factory()
+        changed = []
+        page_token = None
+        while True:
+            response = service.events().list(
+                calendarId=self.calendar_id,
+                singleEvents=True,
+                maxResults=2500,
+                syncToken=sync_token,
+                pageToken=page_token
+            ).execute()
+            changed.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return changed, response.get('nextSyncToken')
+
+    def _apply(self, event):
+        if event.get('status') == 'cancelled':
+            self._conn.execute("DELETE FROM events WHERE id = ?", (event['id'],))
+            return
+        try:
+            start, end = event_bounds(event)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO events (id, start, end, summary, body) VALUES (?, ?, ?, ?, ?)",
+            (event['id'], _utc_key(start), _utc_key(end), event.get('summary') or "", json.dumps(event))
+        )
+
+    ############################################################
+    # Events overlapping [time_min, time_max], ordered by start
+    ############################################################
+    # time_min / time_max are aware datetimes. When title is given, only
+    # events whose summary contains it (case insensitive) are returned.
+    def list_events(self, time_min, time_max, title=None):
+        return list(self.iter_events(time_min, time_max, title))
+
+    ############################################################
+    # Same as list_events(), read page_size rows at a time
+    ############################################################
+    def iter_events(self, time_min, time_max, title=None, page_size=500):
+        # SQLite lower() only folds ASCII, so titles are matched here
+        title = (title or "").lower()
+        last = ("", "")
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT start, id, summary, body FROM events WHERE end > ? AND start < ? "
+                    "AND (start > ? OR (start = ? AND id > ?)) ORDER BY start, id LIMIT ?",
+                    (_utc_key(time_min), _utc_key(time_max), last[0], last[0], last[1], page_size)
+                ).fetchall()
+            for start, event_id, summary, body in rows:
+                if title in summary.lower():
+                    yield json.loads(body)
+            if len(rows) < page_size:
+                return
+            last = rows[-1][:2]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -10,7 +10,15 @@ import subprocess
 
 from datetime import datetime
 from dotenv import load_dotenv
-from ai_agent_google_calendar_event_creater import ai_agent_create_calendar_event
+from ai_agent_google_calendar_event_creater import (
+    ai_agent_create_calendar_event,
+    ai_agent_create_calendar_event_from_telegram
+)
+from source_connectors import get_connector
+from telegram_get_chats import close_telegram, run_telegram_coroutine, start_event_ingestion, TELEGRAM_INGEST_MODE
+from google_email_calendar_libs import read_history_id, start_gmail_watch
+from gmail_watch_receiver import GmailNotificationReceiver
+from daemon_scheduler import AdaptiveScheduler
 
 IS_WINDOWS = platform.system() == "Windows"
 
@@ -101,6 +109,55 @@ else:
         print("DAEMON_SLEEP_TIME not defined in the environment file. Using default time.")
 
 
+#get adaptive scheduler settings
+# Shortest and longest interval between cycles in seconds
+try:
+    MIN_SLEEP_TIME = int(os.getenv('DAEMON_MIN_SLEEP_TIME'))
+except (ValueError, TypeError):
+    MIN_SLEEP_TIME = min(SLEEP_TIME, 300)
+try:
+    MAX_SLEEP_TIME = int(os.getenv('DAEMON_MAX_SLEEP_TIME'))
+except (ValueError, TypeError):
+    MAX_SLEEP_TIME = max(SLEEP_TIME, 4 * 3600)
+# Hours during which new mail is expected, e.g. 08:00-22:00 (empty = all day)
+ACTIVE_HOURS = os.getenv('DAEMON_ACTIVE_HOURS') or None
+# Interval multiplier outside the active hours
+try:
+    QUIET_MULTIPLIER = float(os.getenv('DAEMON_QUIET_MULTIPLIER'))
+except (ValueError, TypeError):
+    QUIET_MULTIPLIER = 3.0
+# Random jitter added to every interval, as a fraction of it
+try:
+    JITTER_RATIO = float(os.getenv('DAEMON_JITTER_RATIO'))
+except (ValueError, TypeError):
+    JITTER_RATIO = 0.1
+# File recording the recent cycles and the next planned wake-up
+SCHEDULE_FILE = os.getenv('DAEMON_SCHEDULE_FILE') or os.path.join(DAEMON_DIR, "daemon_schedule.json")
+
+#get wake-up mode
+# "sleep" runs a cycle every SLEEP_TIME seconds, "watch" runs a cycle as soon
+# as a Gmail notification arrives and falls back to SLEEP_TIME without any
+WAKE_MODE = os.getenv('DAEMON_WAKE_MODE')
+if WAKE_MODE not in ("sleep", "watch"):
+    WAKE_MODE = "sleep"
+
+# Address of the local notification receiver
+GMAIL_WATCH_HOST = os.getenv('GMAIL_WATCH_HOST') or "127.0.0.1"
+try:
+    GMAIL_WATCH_PORT = int(os.getenv('GMAIL_WATCH_PORT'))
+except (ValueError, TypeError):
+    GMAIL_WATCH_PORT = 8085
+GMAIL_WATCH_PATH = os.getenv('GMAIL_WATCH_PATH') or "/gmail/notifications"
+# Optional shared secret expected as ?token=... on the push URL
+GMAIL_WATCH_TOKEN = os.getenv('GMAIL_WATCH_TOKEN') or None
+# Optional Pub/Sub topic to register the Gmail watch on (projects/<id>/topics/<name>)
+GMAIL_WATCH_TOPIC = os.getenv('GMAIL_WATCH_TOPIC') or None
+# Notifications arriving within this many seconds of the first one are handled together
+try:
+    GMAIL_WATCH_COALESCE_SECONDS = float(os.getenv('GMAIL_WATCH_COALESCE_SECONDS'))
+except (ValueError, TypeError):
+    GMAIL_WATCH_COALESCE_SECONDS = 5
+
 #####################################################
 # Log writing function
 # ###################################################
@@ -112,17 +169,87 @@ def write_log(message):
 # Daemon Run function.
 # ###################################################
 def run():
+    # Turn SIGTERM from stop() into SystemExit so the cleanup below runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    receiver = None
+    try:
+        # In "events" mode Telegram messages are processed as they arrive
+        # instead of on each cycle below
+        if get_connector("telegram").enabled and TELEGRAM_INGEST_MODE == "events":
+            write_log("Starting Telegram real-time ingestion")
+            run_telegram_coroutine(start_event_ingestion(ai_agent_create_calendar_event_from_telegram))
+
+        if WAKE_MODE == "watch":
+            receiver = GmailNotificationReceiver(GMAIL_WATCH_HOST, GMAIL_WATCH_PORT, GMAIL_WATCH_PATH, GMAIL_WATCH_TOKEN)
+            receiver.start()
+            write_log(f"Listening for Gmail notifications on {GMAIL_WATCH_HOST}:{receiver.port}{GMAIL_WATCH_PATH}")
+        watch_expiration = 0
+
+        scheduler = AdaptiveScheduler(
+            SLEEP_TIME, MIN_SLEEP_TIME, MAX_SLEEP_TIME,
+            active_hours=ACTIVE_HOURS,
+            quiet_multiplier=QUIET_MULTIPLIER,
+            jitter_ratio=JITTER_RATIO,
+            state_file=SCHEDULE_FILE
+        )
+
+        while True:
+            write_log("Daemon is running")
+            started_at = datetime.now()
+
+            # Renew the Gmail watch a day before it expires
+            if receiver and GMAIL_WATCH_TOPIC and time.time() > watch_expiration - 86400:
+                try:
+                    watch_expiration = start_gmail_watch(GMAIL_WATCH_TOPIC)
+                except Exception as e:
+                    write_log(f"Could not register Gmail watch: {e}")
+
+            ## Call the function to check Gmail and create calendar events
+            write_log("Calling ai_agent_create_calendar_event()")
+            events_created = 0
+            error = None
+            try:
+                events_created = ai_agent_create_calendar_event() or 0
+                write_log("ai_agent_create_calendar_event() completed")
+            except Exception as e:
+                error = e
+                write_log(f"ai_agent_create_calendar_event() failed: {e}")
+
+            delay = scheduler.record_cycle(started_at, datetime.now(), events_created, error)
+
+            if receiver:
+                wait_for_notification(receiver, delay)
+            else:
+                write_log("Sleeping for " + str(delay) + " seconds...")
+                # Sleep for the interval chosen by the scheduler
+                time.sleep(delay)
+    finally:
+        if receiver:
+            receiver.stop()
+        # The Telegram client and its event loop live for the whole daemon run
+        write_log("Closing Telegram connection")
+        close_telegram()
+
+#####################################################
+# Wait for a Gmail notification, or poll after delay seconds
+# ###################################################
+def wait_for_notification(receiver, delay):
+    deadline = time.time() + delay
+    write_log("Waiting up to " + str(delay) + " seconds for Gmail notifications...")
     while True:
-        write_log("Daemon is running")
+        count, history_id = receiver.wait(max(0, deadline - time.time()), GMAIL_WATCH_COALESCE_SECONDS)
+        if not count:
+            write_log("No notification received. Polling.")
+            return
 
-        ## Call the function to check Gmail and create calendar events
-        write_log("Calling ai_agent_create_calendar_event()")
-        ai_agent_create_calendar_event()
-        write_log("ai_agent_create_calendar_event() completed")
+        # Skip the cycle if the checkpoint already covers the notified change
+        checkpoint = read_history_id()
+        if history_id and checkpoint and int(history_id) <= int(checkpoint):
+            write_log(f"{count} notification(s) up to historyId {history_id} already synced.")
+            continue
 
-        write_log("Sleeping for " + str(SLEEP_TIME) + " seconds...")
-        # Sleep for a specified time
-        time.sleep(SLEEP_TIME)  
+        write_log(f"{count} notification(s) received, historyId {history_id}.")
+        return
 
 #####################################################
 # Start function
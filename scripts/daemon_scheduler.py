@@ -0,0 +1,148 @@
+##########################################################
+# Adaptive wake-up scheduler for the daemon
+##########################################################
+# Instead of sleeping a fixed DAEMON_SLEEP_TIME after every cycle, the
+# interval adapts to what the previous cycles found:
+#   - a cycle that created events halves the interval (down to min_sleep),
+#   - a quiet cycle stretches it by growth (up to max_sleep),
+#   - outside the active hours the interval is multiplied by quiet_multiplier,
+#     but the daemon still wakes up when the active hours start,
+#   - a failed cycle (API or LLM error) backs off exponentially from
+#     min_sleep, independent of the interval above,
+#   - every delay gets +/- jitter_ratio random jitter.
+# Each cycle and the planned wake-up are written to the schedule file so the
+# policy can be inspected.
+##########################################################
+import os
+import json
+import random
+from datetime import timedelta
+
+# Number of cycles kept in the schedule file
+HISTORY_SIZE = 50
+
+
+class AdaptiveScheduler:
+
+    def __init__(self, base_sleep, min_sleep, max_sleep, active_hours=None,
+                 quiet_multiplier=3.0, growth=1.5, jitter_ratio=0.1, state_file=None):
+        self.base_sleep = base_sleep
+        self.min_sleep = min(min_sleep, base_sleep)
+        self.max_sleep = max(max_sleep, base_sleep)
+        self.active_hours = parse_active_hours(active_hours)
+        self.quiet_multiplier = quiet_multiplier
+        self.growth = growth
+        self.jitter_ratio = jitter_ratio
+        self.state_file = state_file
+
+        self.interval = base_sleep
+        self.consecutive_failures = 0
+        self.history = []
+        self._load()
+
+    ############################################################
+    # Persisted state
+    ############################################################
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (ValueError, OSError):
+            return
+        self.interval = min(self.max_sleep, max(self.min_sleep, state.get("interval", self.base_sleep)))
+        self.consecutive_failures = state.get("consecutive_failures", 0)
+        self.history = state.get("history", [])[-HISTORY_SIZE:]
+
+    def _save(self):
+        if not self.state_file:
+            return
+        state = {
+            "interval": self.interval,
+            "consecutive_failures": self.consecutive_failures,
+            "history": self.history,
+        }
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    ############################################################
+    # Record a finished cycle and return the seconds to sleep
+    ############################################################
+    def record_cycle(self, started_at, finished_at, events_created=0, error=None):
+        now = finished_at
+
+        if error is not None:
+            self.consecutive_failures += 1
+            delay = min(self.max_sleep, self.min_sleep * 2 ** self.consecutive_failures)
+            reason = f"backoff after {self.consecutive_failures} failure(s)"
+        else:
+            self.consecutive_failures = 0
+            if events_created:
+                self.interval = max(self.min_sleep, self.interval / 2)
+                reason = f"{events_created} event(s) created"
+            else:
+                self.interval = min(self.max_sleep, self.interval * self.growth)
+                reason = "quiet cycle"
+            delay = self.interval
+
+            if not self.is_active(now):
+                delay = min(self.max_sleep, delay * self.quiet_multiplier)
+                # Still wake up when the active hours start
+                delay = min(delay, self.seconds_until_active(now))
+                reason += ", outside active hours"
+
+        delay *= 1 + random.uniform(-self.jitter_ratio, self.jitter_ratio)
+        delay = max(1, int(delay))
+
+        self.history.append({
+            "started_at": started_at.isoformat(timespec="seconds"),
+            "finished_at": finished_at.isoformat(timespec="seconds"),
+            "duration_seconds": round((finished_at - started_at).total_seconds(), 1),
+            "events_created": events_created,
+            "error": str(error) if error is not None else None,
+            "reason": reason,
+            "next_delay_seconds": delay,
+            "next_wake_up": (now + timedelta(seconds=delay)).isoformat(timespec="seconds"),
+        })
+        self.history = self.history[-HISTORY_SIZE:]
+        self._save()
+        return delay
+
+    ############################################################
+    # Active hours
+    ############################################################
+    def is_active(self, now):
+        if not self.active_hours:
+            return True
+        start, end = self.active_hours
+        minutes = now.hour * 60 + now.minute
+        if start <= end:
+            return start <= minutes < end
+        # Window wraps around midnight, e.g. 22:00-06:00
+        return minutes >= start or minutes < end
+
+    def seconds_until_active(self, now):
+        if not self.active_hours or self.is_active(now):
+            return 0
+        start = self.active_hours[0]
+        next_start = now.replace(hour=start // 60, minute=start % 60, second=0, microsecond=0)
+        if next_start <= now:
+            next_start += timedelta(days=1)
+        return (next_start - now).total_seconds()
+
+
+############################################################
+# Parse "HH:MM-HH:MM" into minutes since midnight
+############################################################
+def parse_active_hours(value):
+    if not value:
+        return None
+    try:
+        start, end = value.split("-")
+        return tuple(int(h) * 60 + int(m) for h, m in (t.strip().split(":") for t in (start, end)))
+    except ValueError:
+        print(f"Invalid active hours '{value}'. Treating all hours as active.")
+        return None
@@ -0,0 +1,222 @@
+##########################################################
+# Fuzzy duplicate detection of calendar events
+##########################################################
+# The same appointment often arrives from several sources with different
+# titles, e.g. "Flight BLR-GOA" from the airline mail and "Trip to Goa" from
+# a Telegram chat. Titles are normalized before they are compared:
+#   - lower cased and split into words, stop words dropped,
+#   - airport codes and old city names mapped to the city (ALIASES),
+#   - travel words (flight, trip, train...) mapped to one "travel" token.
+# The shingles of a title are its words plus the character trigrams of the
+# ordinary words, so small spelling differences still match. Places and the
+# travel token are kept whole: their trigrams would make up most of a short
+# title and let unrelated trips match.
+#
+# Candidates are found without comparing every pair: each title gets a
+# MinHash signature, split into LSH bands, and the index keys are
+# (time bucket, band, band values) with buckets of time_window wide. An event
+# is indexed in every bucket it spans, and a new event only looks at the
+# buckets it spans and their neighbours. Candidates are then verified with
+# the exact Jaccard similarity of the shingles and the distance of their
+# start times. When both titles name places they need a place in common,
+# and only the common places are compared, since a route ("BLR-GOA") also
+# names where it starts.
+##########################################################
+import re
+import json
+import random
+import hashlib
+import threading
+from datetime import datetime
+
+from calendar_event_index import event_bounds
+
+# City names for airport codes and old names
+ALIASES = {
+    "blr": "bangalore", "bengaluru": "bangalore",
+    "goi": "goa", "gox": "goa",
+    "bom": "mumbai", "bombay": "mumbai",
+    "del": "delhi", "new delhi": "delhi",
+    "maa": "chennai", "madras": "chennai",
+    "ccu": "kolkata", "calcutta": "kolkata",
+    "hyd": "hyderabad",
+    "cok": "kochi", "cochin": "kochi",
+    "trv": "trivandrum", "thiruvananthapuram": "trivandrum",
+    "pnq": "pune",
+    "ixc": "chandigarh",
+    "dxb": "dubai",
+    "sin": "singapore",
+    "lhr": "london", "lgw": "london",
+    "jfk": "new york", "ewr": "new york", "nyc": "new york",
+    "sfo": "san francisco",
+}
+
+TRAVEL_TOKEN = "travel"
+TRAVEL_WORDS = {
+    "flight", "flights", "fly", "flying", "trip", "travel", "travelling", "traveling", "journey",
+    "train", "bus", "departure", "depart", "arrival", "boarding", "itinerary",
+}
+
+# Tokens compared whole, never split into trigrams
+PLACES = set(ALIASES.values())
+
+STOP_WORDS = {"a", "an", "the", "to", "from", "with", "at", "for", "of", "on", "in", "and", "my", "via", "by"}
+
+# MinHash signature length and LSH bands; 32 bands of 2 rows find pairs with
+# a shingle Jaccard similarity of 0.4 with a probability above 99%
+NUM_PERM = 64
+BANDS = 32
+
+# Longer events are only indexed in their first buckets
+MAX_SPAN_BUCKETS = 64
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(1)
+_PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)
+]
+_MULTI_WORD_ALIASES = sorted((alias for alias in ALIASES if " " in alias), key=len, reverse=True)
+
+
+############################################################
+# Normalize a title into its tokens
+############################################################
+def normalize_title(title):
+    text = " " + re.sub(r"[^a-z0-9]+", " ", (title or "").lower()) + " "
+    for alias in _MULTI_WORD_ALIASES:
+        text = text.replace(f" {alias} ", f" {ALIASES[alias]} ")
+    tokens = []
+    for word in text.split():
+        if word in STOP_WORDS:
+            continue
+        word = TRAVEL_TOKEN if word in TRAVEL_WORDS else ALIASES.get(word, word)
+        if word not in tokens:
+            tokens.append(word)
+    return tokens
+
+def shingles(title):
+    tokens = normalize_title(title)
+    result = set(tokens)
+    for token in tokens:
+        if token != TRAVEL_TOKEN and token not in PLACES:
+            result.update(token[i:i + 3] for i in range(len(token) - 2))
+    return result
+
+def minhash(shingle_set):
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingle_set]
+    if not hashes:
+        return ()
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+############################################################
+# Similarity of two shingle sets
+############################################################
+# Jaccard similarity, 0 when both name places but none in common.
+def title_similarity(first, second):
+    first_places = first & PLACES
+    second_places = second & PLACES
+    if first_places and second_places:
+        common = first_places & second_places
+        if not common:
+            return 0.0
+        first = (first - first_places) | common
+        second = (second - second_places) | common
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class EventDedupIndex:
+
+    def __init__(self, threshold=0.8, time_window_minutes=180, match_log_file=None):
+        self.threshold = threshold
+        self.time_window = max(1, int(time_window_minutes * 60))
+        self.match_log_file = match_log_file
+        self._entries = []
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _entry(self, event):
+        start, end = event_bounds(event)
+        shingle_set = shingles(event.get("summary"))
+        signature = minhash(shingle_set)
+        rows = len(signature) // BANDS
+        bands = [signature[i * rows:(i + 1) * rows] for i in range(BANDS)] if signature else []
+        return {"event": event, "start": start, "end": end, "shingles": shingle_set, "bands": bands}
+
+    ############################################################
+    # Add an event, returns False when it cannot be indexed
+    ############################################################
+    def add(self, event):
+        try:
+            entry = self._entry(event)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return False
+        with self._lock:
+            position = len(self._entries)
+            self._entries.append(entry)
+            for bucket in self._bucket_range(entry, 0):
+                for band_no, band in enumerate(entry["bands"]):
+                    self._buckets.setdefault((bucket, band_no, band), []).append(position)
+        return True
+
+    def _bucket_range(self, entry, margin):
+        first = int(entry["start"].timestamp()) // self.time_window
+        last = max(first, int(entry["end"].timestamp()) // self.time_window)
+        return range(first - margin, min(last, first + MAX_SPAN_BUCKETS) + margin + 1)
+
+    ############################################################
+    # Find an indexed event the given event duplicates
+    ############################################################
+    # Returns (event, similarity, reason) of the closest match, or None.
+    def find_duplicate(self, event):
+        try:
+            entry = self._entry(event)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+        with self._lock:
+            candidates = set()
+            for neighbour in self._bucket_range(entry, 1):
+                for band_no, band in enumerate(entry["bands"]):
+                    candidates.update(self._buckets.get((neighbour, band_no, band), ()))
+            candidates = [self._entries[position] for position in candidates]
+
+        best = None
+        for candidate in candidates:
+            distance = abs((candidate["start"] - entry["start"]).total_seconds())
+            overlaps = candidate["start"] < entry["end"] and candidate["end"] > entry["start"]
+            if distance > self.time_window and not overlaps:
+                continue
+            similarity = title_similarity(entry["shingles"], candidate["shingles"])
+            if similarity < self.threshold:
+                continue
+            if best is None or (similarity, -distance) > (best[1], -best[3]):
+                best = (candidate["event"], similarity, overlaps, distance)
+        if best is None:
+            return None
+
+        match, similarity, overlaps, distance = best
+        when = "overlapping times" if overlaps else f"starts {int(distance // 60)} min apart"
+        return match, similarity, f"similar title ({similarity:.2f}), {when}"
+
+    ############################################################
+    # Append a suppressed event to the match log
+    ############################################################
+    def log_match(self, event, match, similarity, reason):
+        if not self.match_log_file:
+            return
+        line = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "summary": event.get("summary"),
+            "start": event.get("start"),
+            "matched_summary": match.get("summary"),
+            "matched_start": match.get("start"),
+            "similarity": round(similarity, 3),
+            "reason": reason,
+        }
+        with self._lock, open(self.match_log_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line) + "\n")
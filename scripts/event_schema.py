@@ -0,0 +1,184 @@
+##########################################################
+# Schema and validation of the events returned by the LLM
+##########################################################
+# The extraction asks the model for structured output following
+# EVENTS_RESPONSE_FORMAT: {"events": [event, ...]}. Optional values are
+# nullable because strict schemas require every property.
+#
+# Whatever the model returns is checked by validate_event() before it goes
+# to the calendar: a bad event is rejected on its own, the other events of
+# the reply are kept. parse_events_reply() reads replies of models without
+# structured output, either plain JSON or any number of ```json blocks.
+##########################################################
+import re
+import json
+from datetime import datetime
+
+_TIME_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dateTime": {"type": "string"},
+        "timeZone": {"type": "string"},
+    },
+    "required": ["dateTime", "timeZone"],
+    "additionalProperties": False,
+}
+
+EVENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "location": {"type": ["string", "null"]},
+        "description": {"type": ["string", "null"]},
+        "start": _TIME_SCHEMA,
+        "end": _TIME_SCHEMA,
+        "attendees": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"email": {"type": "string"}},
+                "required": ["email"],
+                "additionalProperties": False,
+            },
+        },
+        "reminders": {
+            "type": "object",
+            "properties": {
+                "useDefault": {"type": "boolean"},
+                "overrides": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "method": {"type": "string", "enum": ["email", "popup"]},
+                            "minutes": {"type": "integer"},
+                        },
+                        "required": ["method", "minutes"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["useDefault", "overrides"],
+            "additionalProperties": False,
+        },
+        # Tags of the messages the event was found in, see build_prompts()
+        "source": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary", "location", "description", "start", "end", "attendees", "reminders", "source"],
+    "additionalProperties": False,
+}
+
+EVENTS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "calendar_events",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"events": {"type": "array", "items": EVENT_SCHEMA}},
+            "required": ["events"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+REMINDER_METHODS = ("email", "popup")
+
+
+############################################################
+# Validate and clean one event
+############################################################
+# Returns (event, None) with null values removed, or (None, reason) when the
+# event cannot be created. Invalid attendees and reminders are dropped
+# without rejecting the event.
+def validate_event(event):
+    if not isinstance(event, dict):
+        return None, "not an object"
+    event = {key: value for key, value in event.items() if value is not None}
+
+    summary = event.get("summary")
+    if not isinstance(summary, str) or not summary.strip():
+        return None, "missing summary"
+
+    times = []
+    for key in ("start", "end"):
+        value = event.get(key)
+        if not isinstance(value, dict):
+            return None, f"missing {key}"
+        value = {name: item for name, item in value.items() if item}
+        text = value.get("dateTime") or value.get("date")
+        if not isinstance(text, str):
+            return None, f"missing {key} time"
+        try:
+            times.append(datetime.fromisoformat(text))
+        except ValueError:
+            return None, f"invalid {key} time {text!r}"
+        event[key] = value
+
+    start, end = times
+    if (start.tzinfo is None) == (end.tzinfo is None) and end < start:
+        return None, "ends before it starts"
+
+    if "attendees" in event:
+        attendees = event["attendees"] if isinstance(event["attendees"], list) else []
+        attendees = [
+            attendee for attendee in attendees
+            if isinstance(attendee, dict) and isinstance(attendee.get("email"), str) and "@" in attendee["email"]
+        ]
+        if attendees:
+            event["attendees"] = attendees
+        else:
+            del event["attendees"]
+
+    if "reminders" in event:
+        reminders = event["reminders"]
+        if not isinstance(reminders, dict) or not isinstance(reminders.get("useDefault"), bool):
+            del event["reminders"]
+        else:
+            overrides = [
+                override for override in reminders.get("overrides") or []
+                if isinstance(override, dict) and override.get("method") in REMINDER_METHODS
+                and isinstance(override.get("minutes"), int) and override["minutes"] >= 0
+            ]
+            event["reminders"] = {"useDefault": reminders["useDefault"]}
+            if overrides and not reminders["useDefault"]:
+                event["reminders"]["overrides"] = overrides
+            elif not reminders["useDefault"]:
+                # No usable override left, so keep the calendar defaults
+                event["reminders"]["useDefault"] = True
+
+    return event, None
+
+
+############################################################
+# Read the events of a reply without structured output
+############################################################
+# Accepts {"events": [...]}, a list of events or a single event, as the whole
+# reply or in any number of fenced blocks. Raises ValueError when the reply
+# looks like JSON but none of it can be parsed.
+def parse_events_reply(text):
+    text = text.strip()
+    try:
+        return _events_from_json(json.loads(text))
+    except ValueError:
+        pass
+
+    events = []
+    parsed = False
+    for block in re.findall(r"```(?:json)?\s*(.*?)```", text, re.DOTALL):
+        try:
+            events.extend(_events_from_json(json.loads(block)))
+            parsed = True
+        except ValueError:
+            continue
+
+    if not parsed and ("{" in text or "[" in text):
+        raise ValueError("the reply contains no valid JSON")
+    return events
+
+def _events_from_json(data):
+    if isinstance(data, dict):
+        data = data["events"] if "events" in data else [data]
+    if not isinstance(data, list):
+        raise ValueError("unexpected JSON in the reply")
+    return data
@@ -0,0 +1,76 @@
+##########################################################
+# Cache of the events extracted from each message
+##########################################################
+# Maps (message content, LLM model, prompt version) to the list of events the
+# LLM found in that message, so a replayed window (after a crash, a failed
+# cycle or a reset checkpoint) only sends the messages never seen before to
+# the LLM and gives the same events as the first run.
+#
+# The cache is a single SQLite table:
+#   extractions(key TEXT PRIMARY KEY, events TEXT, created_at REAL)
+# where key is the SHA-256 of the source name, model, prompt version and
+# message text, and events is the JSON list of extracted events.
+##########################################################
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+class ExtractionCache:
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        # Used from the worker threads of the daemon, access is serialized
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions "
+                "(key TEXT PRIMARY KEY, events TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(source, text, model, prompt_version):
+        sha256 = hashlib.sha256()
+        for value in (source, model, prompt_version, text):
+            sha256.update(str(value).encode("utf-8"))
+            sha256.update(b"\0")
+        return sha256.hexdigest()
+
+    ############################################################
+    # Return {key: events} for the keys found in the cache
+    ############################################################
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            # Stay below the SQLite limit on query parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, events FROM extractions WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, events in rows:
+                    found[key] = json.loads(events)
+        return found
+
+    ############################################################
+    # Store the events of several messages, given as {key: events}
+    ############################################################
+    def put_many(self, entries):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO extractions (key, events, created_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(events), now) for key, events in entries.items()]
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
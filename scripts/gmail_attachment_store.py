@@ -0,0 +1,152 @@
+##########################################################
+# Content-addressed store for downloaded email attachments
+##########################################################
+# Attachments are referenced by (messageId, part) and stored once per SHA-256
+# of their content, so
+#   - an attachment that was already fetched is never downloaded again,
+#   - the same file forwarded in several mails is stored once, and
+#   - two different files with the same name no longer overwrite each other.
+#
+# The index lives next to the files in ATTACHMENTS_DIR/.attachment_index.json:
+#   {"refs":  {"<messageId>/<partId>": "<sha256>"},
+#    "blobs": {"<sha256>": {"path", "filename", "size", "last_used"}}}
+##########################################################
+import os
+import re
+import json
+import time
+import hashlib
+
+INDEX_FILE_NAME = ".attachment_index.json"
+
+
+class AttachmentStore:
+
+    def __init__(self, root_dir, max_total_bytes=0, max_age_days=0):
+        self.root_dir = root_dir
+        self.max_total_bytes = max_total_bytes
+        self.max_age_days = max_age_days
+        self.index_file = os.path.join(root_dir, INDEX_FILE_NAME)
+        os.makedirs(root_dir, exist_ok=True)
+        self.index = self._load_index()
+
+    ############################################################
+    # Index persistence
+    ############################################################
+    def _load_index(self):
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+                index.setdefault("refs", {})
+                index.setdefault("blobs", {})
+                return index
+            except (ValueError, OSError):
+                pass
+        return {"refs": {}, "blobs": {}}
+
+    def save(self):
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+
+    @staticmethod
+    def ref_key(message_id, part_id):
+        return f"{message_id}/{part_id}"
+
+    ############################################################
+    # Return the stored path of an attachment, or None
+    ############################################################
+    def lookup(self, message_id, part_id):
+        digest = self.index["refs"].get(self.ref_key(message_id, part_id))
+        blob = self.index["blobs"].get(digest) if digest else None
+        if not blob or not os.path.exists(blob["path"]):
+            return None
+        blob["last_used"] = time.time()
+        return blob["path"]
+
+    ############################################################
+    # Store attachment content and reference it from the message part
+    ############################################################
+    def put(self, message_id, part_id, filename, data):
+        return self.put_stream(message_id, part_id, filename, [data])
+
+    ############################################################
+    # Store attachment content given as an iterable of byte chunks
+    ############################################################
+    # The chunks are written to a temporary file while hashing, so the content
+    # is never held in memory as a whole. Raises ValueError when more than
+    # max_bytes are received.
+    def put_stream(self, message_id, part_id, filename, chunks, max_bytes=0):
+        sha256 = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.root_dir, f".{self.ref_key(message_id, part_id).replace('/', '_')}.part")
+
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise ValueError(f"attachment {filename} is larger than {max_bytes} bytes")
+                    sha256.update(chunk)
+                    f.write(chunk)
+
+            digest = sha256.hexdigest()
+            blob = self.index["blobs"].get(digest)
+            if blob and os.path.exists(blob["path"]):
+                # Same content is already stored
+                os.remove(tmp_path)
+            else:
+                path = self.blob_path(digest, filename)
+                os.replace(tmp_path, path)
+                blob = {"path": path, "filename": filename, "size": size}
+                self.index["blobs"][digest] = blob
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        blob["last_used"] = time.time()
+        self.index["refs"][self.ref_key(message_id, part_id)] = digest
+        return blob["path"]
+
+    def blob_path(self, digest, filename):
+        # Keep the original name readable for the LLM prompt, prefixed by the hash
+        safe_name = re.sub(r'[^\w.\- ]', '_', os.path.basename(filename or "attachment"))
+        return os.path.join(self.root_dir, f"{digest[:16]}_{safe_name}")
+
+    ############################################################
+    # Remove files older than max_age_days, then the least recently
+    # used ones until the store fits in max_total_bytes
+    ############################################################
+    def cleanup(self):
+        blobs = self.index["blobs"]
+        removed = []
+
+        if self.max_age_days:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += [digest for digest, blob in blobs.items() if blob.get("last_used", 0) < cutoff]
+
+        if self.max_total_bytes:
+            remaining = sorted(
+                (blob.get("last_used", 0), digest) for digest, blob in blobs.items() if digest not in removed
+            )
+            total = sum(blobs[digest]["size"] for _, digest in remaining)
+            for _, digest in remaining:
+                if total <= self.max_total_bytes:
+                    break
+                total -= blobs[digest]["size"]
+                removed.append(digest)
+
+        for digest in removed:
+            blob = blobs.pop(digest)
+            if os.path.exists(blob["path"]):
+                os.remove(blob["path"])
+
+        if removed:
+            removed_set = set(removed)
+            self.index["refs"] = {
+                key: digest for key, digest in self.index["refs"].items() if digest not in removed_set
+            }
+            self.save()
+        return len(removed)
@@ -0,0 +1,129 @@
+##########################################################
+# Local receiver for Gmail watch notifications
+##########################################################
+# Gmail users.watch() publishes a message to a Pub/Sub topic whenever the
+# mailbox changes, and a Pub/Sub push subscription POSTs it to an HTTP
+# endpoint. This module is that endpoint: a small HTTP server that accepts
+#   - the Pub/Sub push envelope
+#       {"message": {"data": "<base64 of {\"emailAddress\": ..., \"historyId\": ...}>"}}
+#   - or the notification itself, {"emailAddress": ..., "historyId": ...}
+# and wakes up the daemon, which then runs an incremental fetch.
+#
+# It can be exercised locally by posting fake notifications, e.g.
+#   curl -X POST -d '{"historyId": "12345"}' http://127.0.0.1:8085/gmail/notifications
+##########################################################
+import json
+import base64
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class GmailNotificationReceiver:
+
+    def __init__(self, host="127.0.0.1", port=8085, path="/gmail/notifications", token=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.token = token
+        self._server = None
+        self._thread = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._history_id = None
+        self._count = 0
+
+    ############################################################
+    # Start and stop the HTTP server thread
+    ############################################################
+    def start(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path != receiver.path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if receiver.token and parse_qs(url.query).get("token", [None])[0] != receiver.token:
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    receiver.notify(parse_notification(self.rfile.read(length)))
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                # Any 2xx acknowledges the Pub/Sub message
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        # Port 0 picks a free port
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="gmail-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join(timeout=5)
+            self._server = None
+            self._thread = None
+
+    ############################################################
+    # Record a notification and wake up the waiting daemon
+    ############################################################
+    def notify(self, history_id):
+        with self._lock:
+            self._count += 1
+            if history_id is not None and (self._history_id is None or int(history_id) > int(self._history_id)):
+                self._history_id = history_id
+        self._event.set()
+
+    ############################################################
+    # Wait for notifications
+    ############################################################
+    # Blocks until a notification arrives or timeout seconds pass. After the
+    # first notification it keeps collecting for coalesce_seconds, so a burst
+    # of notifications results in a single fetch. Returns
+    # (number of notifications, highest historyId seen), or (0, None) on timeout.
+    def wait(self, timeout, coalesce_seconds=0):
+        if not self._event.wait(timeout):
+            return 0, None
+        if coalesce_seconds:
+            time.sleep(coalesce_seconds)
+
+        with self._lock:
+            self._event.clear()
+            result = (self._count, self._history_id)
+            self._count = 0
+            self._history_id = None
+        return result
+
+
+############################################################
+# Parse a pushed notification body into its historyId
+############################################################
+def parse_notification(body):
+    try:
+        payload = json.loads(body or b"{}")
+        if "message" in payload:
+            data = payload["message"].get("data") or ""
+            payload = json.loads(base64.b64decode(data + "=" * (-len(data) % 4)) or b"{}")
+    except (ValueError, TypeError, AttributeError) as e:
+        raise ValueError(f"invalid notification: {e}")
+
+    if not isinstance(payload, dict):
+        raise ValueError("invalid notification")
+    history_id = payload.get("historyId")
+    return str(history_id) if history_id is not None else None
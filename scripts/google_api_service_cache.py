@@ -0,0 +1,133 @@
+##########################################################
+# Process-wide cache of Google API credentials and services
+##########################################################
+# authenticate() used to unpickle the token, maybe refresh it and rebuild the
+# discovery client on every call. This module keeps one credentials object per
+# (token file, scope set) and one built service per (api type, scope set) per
+# thread, so repeated calls from the daemon or the Gradio worker threads reuse
+# the same client.
+#
+# Credentials are shared by every thread and refreshed under a lock only when
+# they are close to expiry. Built services are kept per thread because the
+# httplib2 transport underneath a service object is not thread safe.
+##########################################################
+import os
+import pickle
+import threading
+from datetime import datetime, timedelta
+from googleapiclient.discovery import build
+from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+# API type -> (service name, version) for googleapiclient.discovery.build
+API_TYPES = {
+    'Gmail': ('gmail', 'v1'),
+    'GoogleCalendar': ('calendar', 'v3'),
+}
+
+# Refresh the token when it expires within this many seconds
+TOKEN_REFRESH_MARGIN = os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN')
+try:
+    TOKEN_REFRESH_MARGIN = int(TOKEN_REFRESH_MARGIN)
+except (ValueError, TypeError):
+    TOKEN_REFRESH_MARGIN = 300
+
+_creds_lock = threading.Lock()
+_creds_cache = {}
+_thread_services = threading.local()
+
+
+############################################################
+# Check whether the credentials need a refresh
+############################################################
+def _needs_refresh(creds):
+    if not creds.token:
+        return True
+    if creds.expiry is None:
+        return not creds.valid
+    # google-auth keeps expiry as a naive UTC datetime
+    return creds.expiry - timedelta(seconds=TOKEN_REFRESH_MARGIN) <= datetime.utcnow()
+
+
+############################################################
+# Load, refresh or create the credentials for a scope set
+############################################################
+def _load_credentials(token_file, credentials_file, scopes):
+    creds = None
+    if os.path.exists(token_file):
+        with open(token_file, 'rb') as token:
+            creds = pickle.load(token)
+
+    if creds and creds.valid and not _needs_refresh(creds):
+        return creds
+
+    if creds and creds.refresh_token:
+        creds.refresh(Request())
+    else:
+        flow = InstalledAppFlow.from_client_secrets_file(credentials_file, list(scopes))
+        creds = flow.run_local_server(port=0)
+
+    # Save the credentials for future use
+    with open(token_file, 'wb') as token:
+        pickle.dump(creds, token)
+    return creds
+
+
+############################################################
+# Get shared credentials for a token file and scope set
+############################################################
+def get_credentials(token_file, credentials_file, scopes):
+    key = (token_file, tuple(sorted(scopes)))
+    with _creds_lock:
+        creds = _creds_cache.get(key)
+        if creds is None:
+            creds = _load_credentials(token_file, credentials_file, key[1])
+            _creds_cache[key] = creds
+        elif _needs_refresh(creds):
+            if creds.refresh_token:
+                creds.refresh(Request())
+                with open(token_file, 'wb') as token:
+                    pickle.dump(creds, token)
+            else:
+                creds = _load_credentials(token_file, credentials_file, key[1])
+                _creds_cache[key] = creds
+    return creds
+
+
+############################################################
+# Get a cached API service for the calling thread
+############################################################
+def get_service(api_type, token_file, credentials_file, scopes):
+    if api_type not in API_TYPES:
+        raise ValueError("Invalid API type specified. Use 'Gmail' or 'GoogleCalendar'.")
+
+    creds = get_credentials(token_file, credentials_file, scopes)
+
+    services = getattr(_thread_services, 'services', None)
+    if services is None:
+        services = _thread_services.services = {}
+
+    key = (api_type, token_file, tuple(sorted(scopes)))
+    cached = services.get(key)
+    # Rebuild only when the credentials object itself was replaced (re-auth flow);
+    # in-place refreshes are picked up by the existing service automatically.
+    if cached is not None and cached[0] is creds:
+        return cached[1]
+
+    name, version = API_TYPES[api_type]
+    # Use the discovery document bundled with googleapiclient instead of fetching it
+    service = build(name, version, credentials=creds, static_discovery=True, cache_discovery=False)
+    services[key] = (creds, service)
+    return service
+
+
+############################################################
+# Drop all cached credentials and services
+############################################################
+def clear_service_cache():
+    with _creds_lock:
+        _creds_cache.clear()
+    _thread_services.services = {}
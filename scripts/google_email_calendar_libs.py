@@ -1,16 +1,22 @@
 ##########################################################
 # Modules
 ##########################################################
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 import os
-import pickle
 import base64
 from email import message_from_bytes
 from datetime import datetime, timedelta
 import time
+import random
+import threading
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 from dotenv import load_dotenv
+from google_api_service_cache import get_service, get_credentials
+from google.auth.transport.requests import AuthorizedSession
+import fnmatch
+from gmail_attachment_store import AttachmentStore
+from calendar_event_index import EventIntervalIndex, event_bounds
+from event_dedup_index import EventDedupIndex
  
 # Define the scope for Gmail API
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly','https://www.googleapis.com/auth/calendar.events']
@@ -32,6 +38,64 @@ else:
 
 #get attachments directory
 ATTACHMENTS_DIR = os.getenv('ATTACHMENTS_DIR')
+if not ATTACHMENTS_DIR:
+    # If ATTACHMENTS_DIR is not set, use the default directory
+    ATTACHMENTS_DIR = os.path.join(BASE_DIR, 'attachments')
+    print("ATTACHMENTS_DIR not defined in the environment file. Using default directory.")
+
+#get attachment store limits (0 means no limit)
+ATTACHMENTS_MAX_TOTAL_MB = os.getenv('ATTACHMENTS_MAX_TOTAL_MB')
+try:
+    ATTACHMENTS_MAX_TOTAL_MB = int(ATTACHMENTS_MAX_TOTAL_MB)
+except (ValueError, TypeError):
+    ATTACHMENTS_MAX_TOTAL_MB = 0
+
+ATTACHMENTS_MAX_AGE_DAYS = os.getenv('ATTACHMENTS_MAX_AGE_DAYS')
+try:
+    ATTACHMENTS_MAX_AGE_DAYS = int(ATTACHMENTS_MAX_AGE_DAYS)
+except (ValueError, TypeError):
+    ATTACHMENTS_MAX_AGE_DAYS = 0
+
+#get attachment download limits
+# Attachments larger than this are skipped without being downloaded
+ATTACHMENTS_MAX_SIZE_MB = os.getenv('ATTACHMENTS_MAX_SIZE_MB')
+try:
+    ATTACHMENTS_MAX_SIZE_MB = float(ATTACHMENTS_MAX_SIZE_MB)
+except (ValueError, TypeError):
+    ATTACHMENTS_MAX_SIZE_MB = 25
+ATTACHMENTS_MAX_SIZE = int(ATTACHMENTS_MAX_SIZE_MB * 1024 * 1024)
+
+# Comma separated MIME types (wildcards allowed) of attachments to download; empty means all
+ATTACHMENTS_ALLOWED_MIME_TYPES = [
+    mime_type.strip().lower()
+    for mime_type in (os.getenv('ATTACHMENTS_ALLOWED_MIME_TYPES') or "").split(",")
+    if mime_type.strip()
+]
+
+# Size of the decoded chunks written to disk
+ATTACHMENT_CHUNK_SIZE = os.getenv('ATTACHMENT_CHUNK_SIZE')
+try:
+    ATTACHMENT_CHUNK_SIZE = max(3, int(ATTACHMENT_CHUNK_SIZE))
+except (ValueError, TypeError):
+    ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+# Attachments above this size are streamed one by one instead of batched
+ATTACHMENT_STREAM_THRESHOLD_KB = os.getenv('ATTACHMENT_STREAM_THRESHOLD_KB')
+try:
+    ATTACHMENT_STREAM_THRESHOLD = int(ATTACHMENT_STREAM_THRESHOLD_KB) * 1024
+except (ValueError, TypeError):
+    ATTACHMENT_STREAM_THRESHOLD = 1024 * 1024
+
+# Total size of the attachments fetched in one batch call. The client reads
+# the whole batch response into memory, base64 encoded (4/3 of the size).
+ATTACHMENT_BATCH_MAX_KB = os.getenv('ATTACHMENT_BATCH_MAX_KB')
+try:
+    ATTACHMENT_BATCH_MAX_BYTES = max(1, int(ATTACHMENT_BATCH_MAX_KB)) * 1024
+except (ValueError, TypeError):
+    ATTACHMENT_BATCH_MAX_BYTES = 4 * 1024 * 1024
+
+# Gmail REST endpoint used for streamed attachment downloads
+GMAIL_API_BASE_URL = (os.getenv('GMAIL_API_BASE_URL') or "https://gmail.googleapis.com/gmail/v1").rstrip("/")
 
 #get secrets directory
 SECRETS_DIR = os.getenv('SECRETS_DIR')
@@ -121,6 +185,84 @@ except (ValueError, TypeError):
     print("Invalid value for NO_OF_DAYS_TO_LOOK_BACK. Defaulting to 7 days.")
     NO_OF_DAYS_TO_LOOK_BACK = 7
 
+#get gmail batch settings
+# Number of requests sent in one batch HTTP call (Gmail allows up to 100, 50 is recommended)
+GMAIL_BATCH_SIZE = os.getenv('GMAIL_BATCH_SIZE')
+try:
+    GMAIL_BATCH_SIZE = max(1, min(100, int(GMAIL_BATCH_SIZE)))
+except (ValueError, TypeError):
+    GMAIL_BATCH_SIZE = 50
+
+# Number of times a batch item failing with 429/5xx is retried
+GMAIL_BATCH_MAX_RETRIES = os.getenv('GMAIL_BATCH_MAX_RETRIES')
+try:
+    GMAIL_BATCH_MAX_RETRIES = int(GMAIL_BATCH_MAX_RETRIES)
+except (ValueError, TypeError):
+    GMAIL_BATCH_MAX_RETRIES = 3
+
+# Labels of messages that are never read: drafts are not mail we have
+# received or sent, and spam and trash are left out by Gmail searches too
+SKIPPED_LABELS = {'DRAFT', 'SPAM', 'TRASH'}
+
+# Number of message IDs requested per messages().list() page (max 500)
+GMAIL_PAGE_SIZE = os.getenv('GMAIL_PAGE_SIZE')
+try:
+    GMAIL_PAGE_SIZE = max(1, min(500, int(GMAIL_PAGE_SIZE)))
+except (ValueError, TypeError):
+    GMAIL_PAGE_SIZE = 100
+
+# Optional batch endpoint override, e.g. a local fake endpoint for testing
+GMAIL_BATCH_URI = os.getenv('GMAIL_BATCH_URI') or None
+
+# HTTP status codes for which a batch item is retried
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# MIME types of meeting invites, which are parsed without the LLM
+CALENDAR_MIME_TYPES = ("text/calendar", "application/ics")
+
+#get gmail sync mode
+# "history" fetches only the messages added since the last stored historyId,
+# "query" searches the after/before time window on every run
+GMAIL_SYNC_MODE = os.getenv('GMAIL_SYNC_MODE')
+if GMAIL_SYNC_MODE not in ("history", "query"):
+    GMAIL_SYNC_MODE = "history"
+
+#get gmail history checkpoint file
+GMAIL_HISTORY_FILE = os.getenv('GMAIL_HISTORY_FILE')
+if not GMAIL_HISTORY_FILE:
+    GMAIL_HISTORY_FILE = os.path.join(DAEMON_DIR, "gmail_history_id.ts")
+
+#get calendar batch settings
+# Number of event inserts sent in one batch HTTP call (Calendar allows up to 1000, 50 is recommended)
+CALENDAR_BATCH_SIZE = os.getenv('CALENDAR_BATCH_SIZE')
+try:
+    CALENDAR_BATCH_SIZE = max(1, min(1000, int(CALENDAR_BATCH_SIZE)))
+except (ValueError, TypeError):
+    CALENDAR_BATCH_SIZE = 50
+
+# Calendar batch endpoint, overridable e.g. with a local fake endpoint for testing
+CALENDAR_BATCH_URI = os.getenv('CALENDAR_BATCH_URI') or "https://www.googleapis.com/batch/calendar/v3"
+
+#get fuzzy duplicate detection settings
+# An event is a duplicate of an existing one when their normalized titles have
+# at least this similarity (0-1) and they overlap or start within the window
+DEDUP_FUZZY_ENABLED = (os.getenv('DEDUP_FUZZY_ENABLED') or "True") == "True"
+DEDUP_SIMILARITY_THRESHOLD = os.getenv('DEDUP_SIMILARITY_THRESHOLD')
+try:
+    DEDUP_SIMILARITY_THRESHOLD = min(1.0, max(0.0, float(DEDUP_SIMILARITY_THRESHOLD)))
+except (ValueError, TypeError):
+    DEDUP_SIMILARITY_THRESHOLD = 0.8
+DEDUP_TIME_WINDOW_MINUTES = os.getenv('DEDUP_TIME_WINDOW_MINUTES')
+try:
+    DEDUP_TIME_WINDOW_MINUTES = max(1, int(DEDUP_TIME_WINDOW_MINUTES))
+except (ValueError, TypeError):
+    DEDUP_TIME_WINDOW_MINUTES = 180
+
+# JSON lines log of the suppressed duplicates and why
+DEDUP_MATCH_LOG = os.getenv('DEDUP_MATCH_LOG')
+if not DEDUP_MATCH_LOG:
+    DEDUP_MATCH_LOG = os.path.join(LOG_DIR, "dedup_matches.jsonl")
+
 #####################################################
 # Log writing function
 #####################################################
@@ -140,45 +282,29 @@ def logger(log_level, msg):
             f.write(current_time + ' : ' + log_level + ' : ' + msg)
 #end
 
+#####################################################
+# Atomic file writing function
+#####################################################
+# Checkpoints are written to a temporary file, synced to disk and renamed
+# over the old file, so a crash leaves either the old or the new content.
+def write_atomic(path, text):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
 ############################################################
 # Authenticate Gmail and Google Calendar
 ############################################################
 def authenticate(api_type):
 
     logger('INFO', f"Authenticating for {api_type} API...")
-    creds = None
-
-    # Check if token.pickle exists (stores user credentials)
-    # credentials_file_name = os.path.join(SECRETS_DIR, CREDENTIALS_FILE)
-
-    # Check if token.pickle exists (stores user credentials)
-    # token_file_name = os.path.join(SECRETS_DIR, TOKEN_FILE)
 
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
-
-    # If no valid credentials, authenticate the user
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_FILE, SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for future use
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-
-    if (api_type == 'Gmail'):
-        # Build the Gmail API service
-        service = build('gmail', 'v1', credentials=creds)
-    elif (api_type == 'GoogleCalendar'):
-        # Build the Google Calendar API service
-        service = build('calendar', 'v3', credentials=creds)
-    else:
-        raise ValueError("Invalid API type specified. Use 'Gmail' or 'GoogleCalendar'.")
-    return service
+    # Credentials and the built service are cached process-wide, so this only
+    # touches token.pickle or the network when the token is close to expiry.
+    return get_service(api_type, TOKEN_FILE, CREDENTIALS_FILE, SCOPES)
 
 
 ############################################################
@@ -224,14 +350,10 @@ def get_emails(service):
     #query = f'after:2025-03-23 before:2025-03-25'  # Query for emails on the specific date
     logger('DEBUG',f"Query: {query}")
 
-    results = service.users().messages().list(userId='me', q=query).execute()
-    messages = results.get('messages', [])
-
-    logger('INFO',f"Total emails found: {len(messages)} \n")
-   
-    emails = ""
-    for message in messages:
-        msg = service.users().messages().get(userId='me', id=message['id']).execute()
+    emails = []
+    total = 0
+    for msg in iter_messages(service, iter_message_ids(service, query)):
+        total += 1
         payload = msg['payload']
         headers = payload.get('headers', [])
        
@@ -240,8 +362,8 @@ def get_emails(service):
         sender = next((header['value'] for header in headers if header['name'] == 'From'), None)
         logger('DEBUG',f"Subject: {subject}")
         logger('DEBUG',f"From: {sender}")
-        emails += f"Subject: {subject}\n"
-        emails += f"From: {sender}\n"
+        emails.append(f"Subject: {subject}\n")
+        emails.append(f"From: {sender}\n")
        
         # Extract email body
         if 'parts' in payload:
@@ -249,13 +371,15 @@ def get_emails(service):
                 if part['mimeType'] == 'text/plain':
                     body = base64.urlsafe_b64decode(part['body']['data']).decode()
                     logger('DEBUG',f"Body: {body}")
-                    emails += f"Body: {body}\n"
+                    emails.append(f"Body: {body}\n")
                     break
         else:
             body = base64.urlsafe_b64decode(payload['body']['data']).decode()
             logger('DEBUG',f"Body: {body}")
-            emails += f"Body: {body}\n"
-    return emails
+            emails.append(f"Body: {body}\n")
+
+    logger('INFO',f"Total emails found: {total} \n")
+    return "".join(emails)
 
 ############################################################
 # gmail_reader function
@@ -296,12 +420,18 @@ def google_calendar_event_creater(event):
 
     # Extract relevant details from the event
     summary = event.get("summary")
-    start_time = event["start"]["dateTime"]
-    end_time = event["end"]["dateTime"]
+    # All-day events only have a date
+    start_time = event["start"].get("dateTime") or event["start"]["date"]
+    end_time = event["end"].get("dateTime") or event["end"]["date"]
 
     # Convert to datetime objects (assuming ISO format)
     start_dt = datetime.fromisoformat(start_time)
     end_dt = datetime.fromisoformat(end_time)
+    # The list query needs an offset; dates and times without one are local
+    if start_dt.tzinfo is None:
+        start_dt = start_dt.astimezone()
+    if end_dt.tzinfo is None:
+        end_dt = end_dt.astimezone()
 
     # Search for existing events that overlap with this one
     events_result = service.events().list(
@@ -317,103 +447,731 @@ def google_calendar_event_creater(event):
     for existing_event in existing_events:
         if existing_event.get('summary') == summary:
             logger('INFO', "Duplicate event found. Skipping creation.")
-            return  # Don't create the event again
+            return None  # Don't create the event again
 
     # If no duplicate found, insert the event
-    created_event = service.events().insert(calendarId='primary', body=event).execute()
+    try:
+        created_event = service.events().insert(calendarId='primary', body=event).execute()
+    except HttpError as e:
+        # An invite whose iCalUID is already in the calendar
+        if e.resp.status == 409 and event.get("iCalUID"):
+            logger('INFO', "Duplicate event found. Skipping creation.")
+            return None
+        raise
     logger('INFO', f"Event created: {created_event.get('htmlLink')}")
     logger('INFO', "Event created successfully.\n\n")
+    return created_event
 
 #end
 
+############################################################
+# Google Calendar bulk event creator
+############################################################
+# Creates several events with three round trips instead of three per event:
+#   - the existing events of the union time range of all events are listed
+#     once (following every page) into an in-memory interval index,
+#   - an event overlapping an existing event with the same summary, or an
+#     event of the same call, is a duplicate and skipped locally, as is an
+#     event with a similar title close in time (EventDedupIndex),
+#   - the remaining events are inserted through execute_batch().
+# Returns one result per event: the created event, None for a duplicate, or
+# the exception that prevented its creation. Calls are serialized.
+_calendar_write_lock = threading.Lock()
+
+def google_calendar_bulk_event_creater(events, rate_limiter=None):
+    results = [None] * len(events)
+    bounds = {}
+    for i, event in enumerate(events):
+        try:
+            bounds[i] = event_bounds(event)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            results[i] = ValueError(f"Invalid event times: {e}")
+    if not bounds:
+        return results
+
+    logger('INFO', "Authenticating...")
+    service = authenticate("GoogleCalendar")
+    logger('INFO', "Authenticated successfully.")
+
+    # Listing and inserting is one step: a concurrent call (Telegram events
+    # and the polling cycle) listing in between would miss these events
+    with _calendar_write_lock:
+        time_min = min(start for start, _ in bounds.values())
+        time_max = max(end for _, end in bounds.values())
+        existing_events = list_calendar_events(service, time_min, time_max, rate_limiter)
+        index = EventIntervalIndex(existing_events)
+        dedup_index = EventDedupIndex(DEDUP_SIMILARITY_THRESHOLD, DEDUP_TIME_WINDOW_MINUTES, DEDUP_MATCH_LOG)
+        if DEDUP_FUZZY_ENABLED:
+            for existing in existing_events:
+                dedup_index.add(existing)
+        logger('INFO', f"{len(index)} existing event(s) between {time_min.isoformat()} and {time_max.isoformat()}")
+
+        requests = {}
+        for i, (start, end) in bounds.items():
+            summary = events[i].get("summary")
+            match = next((existing for existing in index.overlapping(start, end) if existing.get("summary") == summary), None)
+            if match is not None:
+                duplicate = (match, 1.0, "same title, overlapping times")
+            else:
+                duplicate = dedup_index.find_duplicate(events[i]) if DEDUP_FUZZY_ENABLED else None
+            if duplicate is not None:
+                logger('INFO', f"Duplicate event found. Skipping creation of {summary!r}: {duplicate[2]} with {duplicate[0].get('summary')!r}.")
+                dedup_index.log_match(events[i], *duplicate)
+                continue
+            # Later events of this call are checked against this one as well
+            index.add(events[i])
+            if DEDUP_FUZZY_ENABLED:
+                dedup_index.add(events[i])
+            requests[str(i)] = lambda body=events[i]: service.events().insert(calendarId='primary', body=body)
+
+        created, errors = execute_batch(
+            service, requests, batch_size=CALENDAR_BATCH_SIZE, batch_uri=CALENDAR_BATCH_URI, rate_limiter=rate_limiter
+        )
+    for key, created_event in created.items():
+        logger('INFO', f"Event created: {created_event.get('htmlLink')}")
+        results[int(key)] = created_event
+    for key, error in errors.items():
+        # An invite whose iCalUID is already in the calendar
+        if isinstance(error, HttpError) and error.resp.status == 409 and events[int(key)].get("iCalUID"):
+            logger('INFO', "Duplicate event found. Skipping creation.")
+            continue
+        results[int(key)] = error
+    return results
+
+############################################################
+# List the events of a time range, page by page
+############################################################
+# Recurring events are expanded, so every instance is returned with its own
+# start and end.
+def list_calendar_events(service, time_min, time_max, rate_limiter=None):
+    events = []
+    page_token = None
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        response = service.events().list(
+            calendarId='primary',
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            singleEvents=True,
+            maxResults=2500,
+            pageToken=page_token,
+            fields="nextPageToken,items(summary,start,end)"
+        ).execute()
+        events.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return events
+
+############################################################
+# Execute requests through the batch HTTP endpoint
+############################################################
+# requests maps a string key to a zero-argument callable that builds the
+# HttpRequest, so items can be rebuilt when they have to be retried.
+# Returns (results, errors), both keyed by the request key. When a
+# rate_limiter is given, its wait() is called before every batch call.
+def execute_batch(service, requests, batch_size=None, max_retries=None, batch_uri=None, rate_limiter=None):
+    batch_size = batch_size or GMAIL_BATCH_SIZE
+    max_retries = GMAIL_BATCH_MAX_RETRIES if max_retries is None else max_retries
+    batch_uri = batch_uri or GMAIL_BATCH_URI
+
+    results = {}
+    errors = {}
+    pending = list(requests.items())
+    attempt = 0
+
+    while pending:
+        retry = []
+
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            factories = dict(chunk)
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    results[request_id] = response
+                elif _is_retryable(exception) and attempt < max_retries:
+                    retry.append((request_id, factories[request_id]))
+                else:
+                    errors[request_id] = exception
+
+            if batch_uri:
+                batch = BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+            else:
+                batch = service.new_batch_http_request(callback=callback)
+            for key, factory in chunk:
+                batch.add(factory(), request_id=key)
+
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            try:
+                batch.execute()
+            except HttpError as e:
+                # The batch call itself failed, so none of its items were answered
+                if _is_retryable(e) and attempt < max_retries:
+                    retry.extend(item for item in chunk if item[0] not in results)
+                else:
+                    for key, _ in chunk:
+                        errors.setdefault(key, e)
+
+        if retry:
+            attempt += 1
+            delay = min(2 ** attempt, 32) + random.random()
+            logger('INFO', f"Retrying {len(retry)} batch item(s) in {delay:.1f}s (attempt {attempt}/{max_retries})")
+            time.sleep(delay)
+        pending = retry
+
+    return results, errors
+
+def _is_retryable(exception):
+    return isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUS_CODES
+
+# Deleted between the listing and the fetch, nothing left to read
+def _is_gone(exception):
+    if isinstance(exception, HttpError):
+        return exception.resp.status == 404
+    # requests errors of the streamed downloads
+    response = getattr(exception, "response", None)
+    return getattr(response, "status_code", None) == 404
+
+############################################################
+# Raise when batch items are still failing after the retries
+############################################################
+# The caller's window then stays pending and is fetched again on the next
+# run instead of being committed without these items.
+def raise_failed_items(what, failed):
+    if failed:
+        key, error = next(iter(failed.items()))
+        raise RuntimeError(f"{len(failed)} {what} could not be fetched, first {key}: {error}") from error
+
+############################################################
+# List every message ID matching a query, page by page
+############################################################
+def iter_message_ids(service, query, rate_limiter=None):
+    page_token = None
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        results = service.users().messages().list(
+            userId='me', q=query, maxResults=GMAIL_PAGE_SIZE, pageToken=page_token
+        ).execute()
+        for message in results.get('messages', []):
+            yield message['id']
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+############################################################
+# Fetch full messages for a stream of IDs, one batch at a time
+############################################################
+def iter_message_batches(service, message_ids, batch_size=None, rate_limiter=None):
+    batch_size = batch_size or GMAIL_BATCH_SIZE
+    chunk = []
+    for message_id in message_ids:
+        chunk.append(message_id)
+        if len(chunk) >= batch_size:
+            yield _fetch_message_batch(service, chunk, rate_limiter)
+            chunk = []
+    if chunk:
+        yield _fetch_message_batch(service, chunk, rate_limiter)
+
+def iter_messages(service, message_ids):
+    for batch in iter_message_batches(service, message_ids):
+        yield from batch
+
+def _fetch_message_batch(service, message_ids, rate_limiter=None):
+    message_requests = {
+        message_id: (lambda message_id=message_id:
+                     service.users().messages().get(userId='me', id=message_id))
+        for message_id in message_ids
+    }
+    fetched, failed = execute_batch(service, message_requests, batch_size=len(message_ids),
+                                    rate_limiter=rate_limiter)
+    for message_id, error in list(failed.items()):
+        if _is_gone(error):
+            logger('INFO', f"Email {message_id} was deleted before it could be fetched")
+            del failed[message_id]
+    raise_failed_items("email(s)", failed)
+    # Keep the listing order
+    return [fetched[message_id] for message_id in message_ids if message_id in fetched]
+
+############################################################
+# Parse a message resource into an email record
+############################################################
+def parse_email(msg):
+    payload = msg['payload']
+    headers = payload.get('headers', [])
+
+    record = {
+        "id": msg['id'],
+        "subject": next((header['value'] for header in headers if header['name'] == 'Subject'), None),
+        "sender": next((header['value'] for header in headers if header['name'] == 'From'), None),
+        "body": None,
+        "attachment_parts": [],
+        "attachments": [],
+        "mime_types": [],
+        "calendar_data": [],
+    }
+
+    for part in _iter_leaf_parts(payload):
+        filename = part.get("filename")
+        mime_type = part.get("mimeType")
+        body = part.get("body", {})
+        data = body.get("data")
+        attachment_id = body.get("attachmentId")
+        if mime_type and mime_type not in record["mime_types"]:
+            record["mime_types"].append(mime_type)
+
+        # Get email body
+        if mime_type == "text/plain" and data and record["body"] is None:
+            record["body"] = base64.urlsafe_b64decode(data).decode()
+
+        # Keep inline meeting invites for the ICS parser
+        if mime_type in CALENDAR_MIME_TYPES and data:
+            record["calendar_data"].append(base64.urlsafe_b64decode(data).decode("utf-8", errors="replace"))
+
+        # Collect attachment for download
+        if filename and attachment_id:
+            record["attachment_parts"].append({
+                # partId is stable across fetches, attachmentId is not
+                "part_id": part.get("partId") or attachment_id,
+                "attachment_id": attachment_id,
+                "filename": filename,
+                "mime_type": mime_type,
+                "size": body.get("size", 0),
+            })
+
+    # If no plain/text part found, fallback
+    if record["body"] is None and 'body' in payload and 'data' in payload['body']:
+        record["body"] = base64.urlsafe_b64decode(payload['body']['data']).decode()
+
+    return record
+
+# Invites are usually nested, e.g. multipart/mixed > multipart/alternative >
+# text/calendar, so the part tree is walked down to its leaves
+def _iter_leaf_parts(payload):
+    for part in payload.get('parts', []):
+        if part.get('parts'):
+            yield from _iter_leaf_parts(part)
+        else:
+            yield part
+
+def _is_calendar_part(part):
+    return part["mime_type"] in CALENDAR_MIME_TYPES or (part["filename"] or "").lower().endswith(".ics")
+
+############################################################
+# Format an email record for the LLM prompt
+############################################################
+def format_email(record):
+    text = f"Subject: {record['subject']}\n"
+    text += f"From: {record['sender']}\n"
+    if record["body"] is not None:
+        text += f"Body: {record['body']}\n"
+    for filepath in record["attachments"]:
+        text += f"Attachment saved: {filepath}\n"
+    return text
+
+############################################################
+# Attachment store
+############################################################
+_attachment_store = None
+
+def get_attachment_store():
+    global _attachment_store
+    if _attachment_store is None:
+        _attachment_store = AttachmentStore(
+            ATTACHMENTS_DIR,
+            max_total_bytes=ATTACHMENTS_MAX_TOTAL_MB * 1024 * 1024,
+            max_age_days=ATTACHMENTS_MAX_AGE_DAYS
+        )
+    return _attachment_store
+
+############################################################
+# Check the attachment size and MIME type limits
+############################################################
+def _attachment_allowed(part):
+    if part["size"] and part["size"] > ATTACHMENTS_MAX_SIZE:
+        logger('INFO', f"Skipping attachment {part['filename']}: {part['size']} bytes is over the size limit")
+        return False
+    mime_type = (part["mime_type"] or "").lower()
+    if ATTACHMENTS_ALLOWED_MIME_TYPES and not any(
+            fnmatch.fnmatch(mime_type, pattern) for pattern in ATTACHMENTS_ALLOWED_MIME_TYPES):
+        logger('INFO', f"Skipping attachment {part['filename']}: MIME type {mime_type} is not allowed")
+        return False
+    return True
+
+############################################################
+# Decode base64url data in fixed size chunks
+############################################################
+def iter_base64_chunks(data, chunk_size=None):
+    # 4 base64 characters decode to 3 bytes
+    step = ((chunk_size or ATTACHMENT_CHUNK_SIZE) // 3) * 4
+    for i in range(0, len(data), step):
+        piece = data[i:i + step]
+        yield base64.urlsafe_b64decode(piece + "=" * (-len(piece) % 4))
+
+############################################################
+# Decode the "data" field of a streamed JSON attachment response
+############################################################
+# The attachments().get() response is {"size": ..., "data": "<base64url>"}.
+# The raw body is scanned for the data field and decoded as it arrives,
+# so neither the base64 text nor the decoded file is held in memory.
+def iter_streamed_base64_field(byte_chunks, field="data"):
+    marker = f'"{field}"'.encode()
+    buffer = b""
+    carry = b""
+    in_data = False
+
+    for chunk in byte_chunks:
+        if not in_data:
+            buffer += chunk
+            idx = buffer.find(marker)
+            quote = buffer.find(b'"', idx + len(marker)) if idx >= 0 else -1
+            if quote < 0:
+                # Keep enough of the tail to match a marker split across chunks
+                buffer = buffer[idx:] if idx >= 0 else buffer[-len(marker):]
+                continue
+            chunk = buffer[quote + 1:]
+            buffer = b""
+            in_data = True
+
+        end = chunk.find(b'"')
+        carry += chunk if end < 0 else chunk[:end]
+        usable = len(carry) - len(carry) % 4
+        if usable:
+            yield base64.urlsafe_b64decode(carry[:usable])
+            carry = carry[usable:]
+        if end >= 0:
+            break
+
+    if carry:
+        yield base64.urlsafe_b64decode(carry + b"=" * (-len(carry) % 4))
+
+def _iter_streamed_attachment(session, message_id, attachment_id):
+    url = f"{GMAIL_API_BASE_URL}/users/me/messages/{message_id}/attachments/{attachment_id}"
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        yield from iter_streamed_base64_field(response.iter_content(chunk_size=ATTACHMENT_CHUNK_SIZE))
+
+############################################################
+# Download the attachments of a batch of email records
+############################################################
+# Attachments already in the store are reused without a network call. Small
+# ones are fetched through the batch endpoint, in batches of at most
+# ATTACHMENT_BATCH_MAX_BYTES, large ones are streamed one by one, and both are
+# decoded to disk in ATTACHMENT_CHUNK_SIZE pieces.
+def _download_attachments(service, records, batch_size=None, rate_limiter=None):
+    store = get_attachment_store()
+
+    batched_parts = []
+    streamed_parts = []
+    for record in records:
+        for part in record["attachment_parts"]:
+            if not _attachment_allowed(part):
+                continue
+            filepath = store.lookup(record["id"], part["part_id"])
+            if filepath:
+                logger('DEBUG', f"Attachment {part['filename']} already stored at {filepath}\n")
+                record["attachments"].append(filepath)
+            elif part["size"] > ATTACHMENT_STREAM_THRESHOLD:
+                streamed_parts.append((record, part))
+            else:
+                batched_parts.append((record, part))
+
+    # Failed attachments by "email id/filename"
+    errors = {}
+    # Each group is stored before the next one is fetched
+    for group in _size_limited_groups(batched_parts, batch_size or GMAIL_BATCH_SIZE, ATTACHMENT_BATCH_MAX_BYTES):
+        attachment_requests = {
+            str(i): (lambda message_id=record["id"], attachment_id=part["attachment_id"]:
+                     service.users().messages().attachments().get(
+                         userId='me', messageId=message_id, id=attachment_id))
+            for i, (record, part) in enumerate(group)
+        }
+        downloaded, failed = execute_batch(service, attachment_requests, batch_size=len(group),
+                                           rate_limiter=rate_limiter)
+
+        for i, (record, part) in enumerate(group):
+            attachment = downloaded.pop(str(i), None)
+            error = failed.get(str(i))
+            if attachment is None:
+                if _is_gone(error):
+                    logger('INFO', f"Email {record['id']} was deleted before attachment {part['filename']} was downloaded")
+                else:
+                    errors[f"{record['id']}/{part['filename']}"] = error
+                continue
+            try:
+                _store_attachment(store, record, part, iter_base64_chunks(attachment.pop('data', "")))
+            except Exception as e:
+                errors[f"{record['id']}/{part['filename']}"] = e
+
+    if streamed_parts:
+        session = AuthorizedSession(get_credentials(TOKEN_FILE, CREDENTIALS_FILE, SCOPES))
+        for record, part in streamed_parts:
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            chunks = _iter_streamed_attachment(session, record["id"], part["attachment_id"])
+            try:
+                _store_attachment(store, record, part, chunks)
+            except Exception as e:
+                if _is_gone(e):
+                    logger('INFO', f"Email {record['id']} was deleted before attachment {part['filename']} was downloaded")
+                else:
+                    errors[f"{record['id']}/{part['filename']}"] = e
+
+    # Keep what was stored, the next run reuses it
+    store.save()
+    raise_failed_items("attachment(s)", errors)
+
+# Splits (record, part) pairs into groups of at most max_items parts and
+# max_bytes in total; a larger part gets a group of its own
+def _size_limited_groups(parts, max_items, max_bytes):
+    group = []
+    group_bytes = 0
+    for record, part in parts:
+        if group and (len(group) >= max_items or group_bytes + part["size"] > max_bytes):
+            yield group
+            group = []
+            group_bytes = 0
+        group.append((record, part))
+        group_bytes += part["size"]
+    if group:
+        yield group
+
+# Raises when the download or the write fails; attachments over the size
+# limit or with broken data are skipped for good.
+def _store_attachment(store, record, part, chunks):
+    try:
+        filepath = store.put_stream(record["id"], part["part_id"], part["filename"], chunks,
+                                    max_bytes=ATTACHMENTS_MAX_SIZE)
+    except ValueError as e:
+        logger('INFO', f"Skipping attachment {part['filename']} of email {record['id']}: {e}")
+        return
+    print(f"Saving attachment to {filepath}")
+    record["attachments"].append(filepath)
+
 ##################################################################
-# Get emails with attachments
+# Stream emails with attachments
 ##################################################################
-def get_emails_with_attachments(service, after_ts, before_ts):
+# Follows every page of the listing and yields one parsed email record at a
+# time. Only one batch of messages (batch_size, GMAIL_BATCH_SIZE by default)
+# is held in memory. Without before_ts the search runs up to now.
+def iter_emails_with_attachments(service, after_ts, before_ts, message_ids=None, batch_size=None, rate_limiter=None):
 
-    query = f'after:{after_ts} before:{before_ts}'
+    if message_ids is None:
+        query = f'after:{after_ts}' if before_ts is None else f'after:{after_ts} before:{before_ts}'
+        logger('INFO', f"Query: {query}")
+        message_ids = iter_message_ids(service, query, rate_limiter)
 
-    logger('INFO', f"Query: {query}")
-    results = service.users().messages().list(userId='me', q=query).execute()
-    messages = results.get('messages', [])
+    # Drop expired attachments before this run adds new ones
+    removed = get_attachment_store().cleanup()
+    if removed:
+        logger('INFO', f"Removed {removed} old attachment file(s)")
 
-    logger('INFO', f"Total emails found: {len(messages)} \n")
+    total = 0
+    for batch in iter_message_batches(service, message_ids, batch_size, rate_limiter):
+        # Labels may have changed since the listing (moved to spam or trash)
+        records = [parse_email(msg) for msg in batch if not SKIPPED_LABELS.intersection(msg.get('labelIds', []))]
+        _download_attachments(service, records, batch_size, rate_limiter)
+        total += len(records)
+        yield from records
 
-    emails = ""
-    all_attachments = []
+    logger('INFO', f"Total emails found: {total} \n")
 
-    for message in messages:
-        msg = service.users().messages().get(userId='me', id=message['id']).execute()
-        payload = msg['payload']
-        headers = payload.get('headers', [])
-       
-        subject = next((header['value'] for header in headers if header['name'] == 'Subject'), None)
-        sender = next((header['value'] for header in headers if header['name'] == 'From'), None)
+############################################################
+# Gmail historyId checkpoint
+############################################################
+def read_history_id():
+    if not os.path.exists(GMAIL_HISTORY_FILE):
+        return None
+    with open(GMAIL_HISTORY_FILE, "r") as f:
+        lines = f.readlines()
+    if not lines:
+        return None
+    return lines[0].strip().split(":", 1)[1] or None
 
-        emails += f"Subject: {subject}\n"
-        emails += f"From: {sender}\n"
+def write_history_id(history_id):
+    write_atomic(GMAIL_HISTORY_FILE, f"GMAIL_HISTORY_ID:{history_id}")
 
-        parts = payload.get('parts', [])
-        email_body_found = False
+############################################################
+# List the messages added since a historyId
+############################################################
+# Returns (message_ids, latest_history_id). Raises HttpError 404 when the
+# start historyId is too old for the History API.
+def list_history_message_ids(service, start_history_id):
+    message_ids = []
+    seen = set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        results = service.users().history().list(
+            userId='me',
+            startHistoryId=start_history_id,
+            historyTypes=['messageAdded'],
+            maxResults=GMAIL_PAGE_SIZE,
+            pageToken=page_token
+        ).execute()
+        latest_history_id = results.get('historyId', latest_history_id)
+
+        for history in results.get('history', []):
+            for added in history.get('messagesAdded', []):
+                message = added['message']
+                if SKIPPED_LABELS.intersection(message.get('labelIds', [])) or message['id'] in seen:
+                    continue
+                seen.add(message['id'])
+                message_ids.append(message['id'])
 
-        for part in parts:
-            filename = part.get("filename")
-            mime_type = part.get("mimeType")
-            body = part.get("body", {})
-            data = body.get("data")
-            attachment_id = body.get("attachmentId")
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
 
-            # Get email body
-            if mime_type == "text/plain" and data and not email_body_found:
-                decoded_body = base64.urlsafe_b64decode(data).decode()
-                emails += f"Body: {decoded_body}\n"
-                email_body_found = True
+    return message_ids, latest_history_id
+
+############################################################
+# Register a Gmail watch on a Pub/Sub topic
+############################################################
+# Gmail then publishes a notification with the new historyId whenever the
+# mailbox changes. A watch expires after 7 days and has to be renewed.
+# Returns the expiration time as epoch seconds.
+def start_gmail_watch(topic_name, label_ids=None):
+    service = authenticate("Gmail")
+    response = service.users().watch(
+        userId='me',
+        body={'topicName': topic_name, 'labelIds': label_ids or ['INBOX']}
+    ).execute()
+    logger('INFO', f"Gmail watch registered on {topic_name} at historyId {response.get('historyId')}")
+    return int(response['expiration']) / 1000
+
+##################################################################
+# Stream new emails using the configured sync mode
+##################################################################
+# In history mode only the messages added since the stored historyId are
+# fetched; without a usable checkpoint the time-window query is used instead.
+# The historyId to store once the run has succeeded is put in sync_state.
+def iter_new_emails(service, after_ts, before_ts, sync_state, batch_size=None, rate_limiter=None):
+    start_history_id = read_history_id() if GMAIL_SYNC_MODE == "history" else None
 
-            # Download attachment
-            if filename and attachment_id:
-                attachment = service.users().messages().attachments().get(
-                    userId='me',
-                    messageId=message['id'],
-                    id=attachment_id
-                ).execute()
+    if start_history_id:
+        try:
+            message_ids, latest_history_id = list_history_message_ids(service, start_history_id)
+            logger('INFO', f"History sync from {start_history_id} to {latest_history_id}: {len(message_ids)} new emails")
+            sync_state['history_id'] = latest_history_id
+            yield from iter_emails_with_attachments(service, after_ts, before_ts, message_ids,
+                                                    batch_size, rate_limiter)
+            return
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger('INFO', f"History checkpoint {start_history_id} has expired. Falling back to time window query.")
 
-                file_data = base64.urlsafe_b64decode(attachment['data'])
+    # Read the current historyId before searching so nothing added meanwhile is
+    # missed. before_ts was fixed earlier, so the search gets no upper bound:
+    # mail received between before_ts and this historyId is only found by it.
+    # Mail found by both is caught by the duplicate checks.
+    if GMAIL_SYNC_MODE == "history":
+        sync_state['history_id'] = service.users().getProfile(userId='me').execute()['historyId']
+        before_ts = None
+    yield from iter_emails_with_attachments(service, after_ts, before_ts,
+                                            batch_size=batch_size, rate_limiter=rate_limiter)
 
-                filepath = os.path.join(ATTACHMENTS_DIR, filename)
-                print(f"Saving attachment to {filepath}")
-                with open(filepath, 'wb') as f:
-                    f.write(file_data)
+##################################################################
+# Get emails with attachments
+##################################################################
+def get_emails_with_attachments(service, after_ts, before_ts):
 
-                emails += f"Attachment saved: {filepath}\n"
-                all_attachments.append(filepath)
+    emails = []
+    all_attachments = []
 
-        # If no plain/text part found, fallback
-        if not email_body_found and 'body' in payload and 'data' in payload['body']:
-            decoded_body = base64.urlsafe_b64decode(payload['body']['data']).decode()
-            emails += f"Body: {decoded_body}\n"
+    for record in iter_emails_with_attachments(service, after_ts, before_ts):
+        emails.append(format_email(record))
+        all_attachments.extend(record["attachments"])
 
-    return emails, all_attachments
+    return "".join(emails), all_attachments
 
 
 ############################################################
-# Gmail Reader with attachments
+# Read new emails as prompt records
 ############################################################
-def gmail_with_attachments_reader(after_ts, before_ts):
+# Returns one record per email: {"source", "id", "sender", "text",
+# "content", "mime_types", "attachments", "calendar_data"}, where text is the
+# email formatted for the LLM prompt, content its subject, body and
+# attachment names, and calendar_data the iCalendar texts of its inline
+# invites and .ics attachments. When a sync_state dict is given, the new historyId is put in it
+# for the caller to store with write_history_id() once the emails have been
+# processed; otherwise it is stored right away.
+#
+# Memory limit: the emails are fetched one batch at a time, but the records
+# of the whole window are returned as one list, because the caller keeps them
+# in the pending window file until the window is committed. Each record holds
+# the full formatted email, so a large backlog (the first run, with
+# NO_OF_DAYS_TO_LOOK_BACK days, or a long outage) is held in memory as a
+# whole, roughly the total size of the email bodies. Only attachments are
+# kept on disk. Shorten NO_OF_DAYS_TO_LOOK_BACK to bound the first run.
+def read_gmail_records(after_ts, before_ts, batch_size=None, rate_limiter=None, sync_state=None):
     # Authenticate and get the Gmail API service
     logger('INFO', "Authenticating...")
     service = authenticate("Gmail")
     logger('INFO', "Authenticated successfully.")
-      
-    # Fetch and print emails for the specified date
-    emails, attachments = get_emails_with_attachments(service,after_ts,before_ts)
-    logger('DEBUG', emails)
-    emails += "\n\nAttachments:\n"
 
-    for attachment in attachments:
-        emails += f"{attachment}\n"
-        logger('DEBUG', attachment)
-    
+    # Consume the emails one at a time as they are fetched
+    records = []
+    commit = sync_state is None
+    if commit:
+        sync_state = {}
+    store = get_attachment_store()
+    for record in iter_new_emails(service, after_ts, before_ts, sync_state, batch_size, rate_limiter):
+        for part in record["attachment_parts"]:
+            filepath = store.lookup(record["id"], part["part_id"]) if _is_calendar_part(part) else None
+            if filepath:
+                with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+                    record["calendar_data"].append(f.read())
+        email_text = format_email(record)
+        logger('DEBUG', email_text)
+        records.append({
+            "source": "gmail",
+            "id": record["id"],
+            "sender": record["sender"],
+            "text": email_text,
+            "content": "\n".join(
+                [record["subject"] or "", record["body"] or ""]
+                + [part["filename"] for part in record["attachment_parts"]]
+            ),
+            "mime_types": record["mime_types"],
+            "attachments": record["attachments"],
+            "calendar_data": record["calendar_data"],
+        })
+
+    logger('INFO', f"{len(records)} email record(s) read, {sum(len(record['text']) for record in records)} characters of prompt text")
+
+    # All emails were read, so advance the history checkpoint
+    if commit and sync_state.get('history_id'):
+        write_history_id(sync_state['history_id'])
+
+    return records
+
+############################################################
+# Format email records and their attachment list for the prompt
+############################################################
+def format_gmail_records(records):
+    emails = [record["text"] for record in records]
+    emails.append("\n\nAttachments:\n")
+    for record in records:
+        for attachment in record["attachments"]:
+            emails.append(f"{attachment}\n")
+            logger('DEBUG', attachment)
+    return "".join(emails)
+
+############################################################
+# Gmail Reader with attachments
+############################################################
+# Returns the whole window as one string, so the same memory limit as
+# read_gmail_records() applies, plus the joined copy.
+def gmail_with_attachments_reader(after_ts, before_ts):
+    emails = format_gmail_records(read_gmail_records(after_ts, before_ts))
+
     # Print the email content
     logger('DEBUG', "Email content:\n")
     logger('DEBUG', emails)
-    return emails
\ No newline at end of file
+    return emails
@@ -0,0 +1,343 @@
+##########################################################
+# iCalendar (.ics) parser for meeting invites
+##########################################################
+# Meeting invites arrive as text/calendar parts or .ics attachments. They
+# already describe the event exactly, so instead of asking the LLM they are
+# converted here into Google Calendar event bodies:
+#   - folded lines are unfolded and text values unescaped,
+#   - DTSTART / DTEND / DURATION become start and end, as a date for all-day
+#     events or as a dateTime with offset and timeZone otherwise,
+#   - TZID parameters are resolved with zoneinfo, Windows zone names through
+#     WINDOWS_TIMEZONES and unknown ones through the VTIMEZONE of the file,
+#   - RRULE, RDATE, EXDATE and EXRULE lines are passed on as "recurrence",
+#     RDATE / EXDATE times with a TZID converted to UTC,
+#   - ATTENDEE lines become attendees with name, response status and
+#     optional flag,
+#   - UID becomes iCalUID, so the same invite is not inserted twice.
+# Only invites and published calendars (METHOD:REQUEST, METHOD:PUBLISH or no
+# METHOD) produce events. Cancellations (METHOD:CANCEL or STATUS:CANCELLED)
+# and the iTIP answers of attendees (REPLY, COUNTER, REFRESH...) are skipped.
+# So are single occurrences of a recurring event (RECURRENCE-ID): created on
+# their own they would carry the iCalUID of the whole series, and either be
+# refused as already existing or be inserted next to it.
+##########################################################
+import re
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    ZoneInfo = None
+
+# Common Windows time zone names used by Outlook / Exchange invites
+WINDOWS_TIMEZONES = {
+    "India Standard Time": "Asia/Kolkata",
+    "Sri Lanka Standard Time": "Asia/Colombo",
+    "Singapore Standard Time": "Asia/Singapore",
+    "China Standard Time": "Asia/Shanghai",
+    "Tokyo Standard Time": "Asia/Tokyo",
+    "Arabian Standard Time": "Asia/Dubai",
+    "AUS Eastern Standard Time": "Australia/Sydney",
+    "GMT Standard Time": "Europe/London",
+    "W. Europe Standard Time": "Europe/Berlin",
+    "Romance Standard Time": "Europe/Paris",
+    "Central Europe Standard Time": "Europe/Budapest",
+    "Eastern Standard Time": "America/New_York",
+    "Central Standard Time": "America/Chicago",
+    "Mountain Standard Time": "America/Denver",
+    "Pacific Standard Time": "America/Los_Angeles",
+    "UTC": "UTC",
+    "Coordinated Universal Time": "UTC",
+}
+
+RESPONSE_STATUS = {
+    "NEEDS-ACTION": "needsAction",
+    "ACCEPTED": "accepted",
+    "DECLINED": "declined",
+    "TENTATIVE": "tentative",
+}
+
+RECURRENCE_PROPERTIES = ("RRULE", "RDATE", "EXDATE", "EXRULE")
+
+# iTIP methods of the messages that describe events to create
+EVENT_METHODS = (None, "REQUEST", "PUBLISH")
+
+_DURATION = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+
+
+############################################################
+# Split the calendar into unfolded content lines
+############################################################
+# Returns (name, params, value, raw line) tuples, name and parameter names
+# in upper case.
+def parse_lines(text):
+    lines = []
+    for line in re.split(r"\r\n|\n|\r", text):
+        if line[:1] in (" ", "\t") and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+
+    parsed = []
+    for line in lines:
+        name_part, value = _split_value(line)
+        if name_part is None:
+            continue
+        pieces = _split_unquoted(name_part, ";")
+        params = {}
+        for piece in pieces[1:]:
+            key, _, param_value = piece.partition("=")
+            params[key.upper()] = param_value.strip('"')
+        parsed.append((pieces[0].upper(), params, value, line))
+    return parsed
+
+def _split_value(line):
+    # The first ":" outside a quoted parameter value ends the name part
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ":" and not quoted:
+            return line[:i], line[i + 1:]
+    return None, None
+
+def _split_unquoted(text, separator):
+    parts = [""]
+    quoted = False
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        if char == separator and not quoted:
+            parts.append("")
+        else:
+            parts[-1] += char
+    return parts
+
+def unescape_text(value):
+    return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+############################################################
+# Parse the components of a calendar
+############################################################
+# Returns (method, vevents, vtimezones): vevents is a list of
+# {name: [(params, value, raw line)]} and vtimezones maps a TZID to the
+# UTC offset of its standard time.
+def parse_components(text):
+    method = None
+    vevents = []
+    vtimezones = {}
+    stack = []
+    current = None
+    tzid = None
+
+    for name, params, value, raw in parse_lines(text):
+        if name == "BEGIN":
+            stack.append(value.upper())
+            if value.upper() == "VEVENT":
+                current = {}
+            elif value.upper() == "VTIMEZONE":
+                tzid = None
+        elif name == "END":
+            if stack:
+                stack.pop()
+            if value.upper() == "VEVENT" and current is not None:
+                vevents.append(current)
+                current = None
+        elif stack == ["VCALENDAR"] and name == "METHOD":
+            method = value.strip().upper()
+        elif stack[-1:] == ["VEVENT"] and current is not None:
+            current.setdefault(name, []).append((params, value, raw))
+        elif stack[-1:] == ["VTIMEZONE"] and name == "TZID":
+            tzid = value.strip()
+        elif stack[-2:] in (["VTIMEZONE", "STANDARD"], ["VTIMEZONE", "DAYLIGHT"]) and name == "TZOFFSETTO":
+            # Prefer the standard offset, daylight only when there is none
+            if tzid and (stack[-1] == "STANDARD" or tzid not in vtimezones):
+                vtimezones[tzid] = value.strip()
+
+    return method, vevents, vtimezones
+
+
+############################################################
+# Resolve a TZID
+############################################################
+# Returns (tzinfo, IANA name or None)
+def resolve_timezone(tzid, vtimezones):
+    if tzid:
+        name = WINDOWS_TIMEZONES.get(tzid, tzid)
+        # Some producers prefix the name, e.g. "/mozilla.org/20050126_1/Europe/Berlin"
+        for candidate in (name, "/".join(name.strip("/").split("/")[-2:])):
+            if ZoneInfo is None:
+                break
+            try:
+                return ZoneInfo(candidate), candidate
+            except (ZoneInfoNotFoundError, ValueError):
+                continue
+        offset = _parse_offset(vtimezones.get(tzid, ""))
+        if offset is not None:
+            return timezone(offset), None
+    return None, None
+
+def _parse_offset(value):
+    match = re.match(r"^([+-])(\d{2})(\d{2})(\d{2})?$", value or "")
+    if not match:
+        return None
+    sign = -1 if match.group(1) == "-" else 1
+    return sign * timedelta(hours=int(match.group(2)), minutes=int(match.group(3)), seconds=int(match.group(4) or 0))
+
+
+############################################################
+# Parse DTSTART / DTEND style values
+############################################################
+# Returns a date for all-day values, an aware datetime otherwise. Floating
+# times are taken as default_timezone, or local time when it is not given.
+def parse_datetime(params, value, vtimezones, default_timezone=None):
+    value = value.strip()
+    if params.get("VALUE", "").upper() == "DATE" or re.fullmatch(r"\d{8}", value):
+        return datetime.strptime(value[:8], "%Y%m%d").date(), None
+
+    utc = value.endswith("Z")
+    dt = datetime.strptime(value.rstrip("Z")[:15], "%Y%m%dT%H%M%S")
+    if utc:
+        return dt.replace(tzinfo=timezone.utc), "UTC"
+
+    tzinfo, tz_name = resolve_timezone(params.get("TZID"), vtimezones)
+    if tzinfo is None and default_timezone:
+        tzinfo, tz_name = resolve_timezone(default_timezone, vtimezones)
+    if tzinfo is None:
+        return dt.astimezone(), None
+    return dt.replace(tzinfo=tzinfo), tz_name
+
+def parse_duration(value):
+    match = _DURATION.match(value.strip())
+    if not match:
+        return None
+    parts = {key: int(number) for key, number in match.groupdict().items() if key != "sign" and number}
+    duration = timedelta(**parts)
+    return -duration if match.group("sign") == "-" else duration
+
+def _google_time(value, tz_name):
+    if not isinstance(value, datetime):
+        return {"date": value.isoformat()}
+    google_time = {"dateTime": value.isoformat()}
+    if tz_name:
+        google_time["timeZone"] = tz_name
+    return google_time
+
+
+############################################################
+# Recurrence line for the Google Calendar API
+############################################################
+# Google only knows IANA zone names, so RDATE / EXDATE times with a TZID are
+# converted to UTC. Other lines are passed on unchanged.
+def recurrence_line(name, params, value, raw, vtimezones, default_timezone=None):
+    if name not in ("RDATE", "EXDATE") or "TZID" not in params or params.get("VALUE", "").upper() in ("DATE", "PERIOD"):
+        return raw
+    times = [parse_datetime(params, item, vtimezones, default_timezone)[0] for item in value.split(",") if item.strip()]
+    return f"{name}:" + ",".join(dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ") for dt in times)
+
+
+############################################################
+# Convert one VEVENT into a Google Calendar event body
+############################################################
+def vevent_to_google_event(vevent, vtimezones, default_timezone=None):
+
+    def first(name):
+        values = vevent.get(name)
+        return values[0] if values else (None, None, None)
+
+    start_params, start_value, _ = first("DTSTART")
+    if start_value is None:
+        return None
+    start, start_tz = parse_datetime(start_params, start_value, vtimezones, default_timezone)
+
+    end_params, end_value, _ = first("DTEND")
+    if end_value is not None:
+        end, end_tz = parse_datetime(end_params, end_value, vtimezones, default_timezone)
+    else:
+        duration = parse_duration(first("DURATION")[1] or "")
+        if duration is None:
+            # RFC 5545: a date lasts one day, a date-time has no duration
+            duration = timedelta(days=1) if not isinstance(start, datetime) else timedelta(0)
+        end, end_tz = start + duration, start_tz
+
+    event = {
+        "summary": unescape_text(first("SUMMARY")[1] or "").strip() or "(No title)",
+        "start": _google_time(start, start_tz),
+        "end": _google_time(end, end_tz),
+    }
+
+    location = unescape_text(first("LOCATION")[1] or "").strip()
+    if location:
+        event["location"] = location
+
+    description = unescape_text(first("DESCRIPTION")[1] or "").strip()
+    organizer_params, organizer, _ = first("ORGANIZER")
+    if organizer:
+        name = organizer_params.get("CN") or re.sub(r"(?i)^mailto:", "", organizer)
+        description = (description + "\n\n" if description else "") + f"Organizer: {name}"
+    if description:
+        event["description"] = description
+
+    uid = (first("UID")[1] or "").strip()
+    if uid:
+        event["iCalUID"] = uid
+
+    recurrence = [
+        recurrence_line(name, params, value, raw, vtimezones, default_timezone)
+        for name in RECURRENCE_PROPERTIES for params, value, raw in vevent.get(name, [])
+    ]
+    if recurrence:
+        event["recurrence"] = recurrence
+        # Google needs a time zone to expand recurring timed events
+        if isinstance(start, datetime):
+            event["start"].setdefault("timeZone", start_tz or default_timezone or "UTC")
+            event["end"].setdefault("timeZone", end_tz or default_timezone or "UTC")
+
+    attendees = []
+    for params, value, _ in vevent.get("ATTENDEE", []):
+        email = re.sub(r"(?i)^mailto:", "", value.strip())
+        if "@" not in email:
+            continue
+        attendee = {"email": email}
+        if params.get("CN"):
+            attendee["displayName"] = params["CN"]
+        status = RESPONSE_STATUS.get(params.get("PARTSTAT", "").upper())
+        if status:
+            attendee["responseStatus"] = status
+        if params.get("ROLE", "").upper() == "OPT-PARTICIPANT":
+            attendee["optional"] = True
+        attendees.append(attendee)
+    if attendees:
+        event["attendees"] = attendees
+
+    return event
+
+
+############################################################
+# Parse a calendar into Google Calendar event bodies
+############################################################
+# Returns (events, skipped): the events to create and, for every skipped
+# event, why it was skipped.
+def ics_to_google_events(text, default_timezone=None):
+    method, vevents, vtimezones = parse_components(text)
+    events = []
+    skipped = []
+    for vevent in vevents:
+        status = (vevent.get("STATUS", [({}, "", "")])[0][1] or "").strip().upper()
+        if method not in EVENT_METHODS:
+            skipped.append(f"{method} message")
+            continue
+        if status == "CANCELLED":
+            skipped.append("cancelled")
+            continue
+        if "RECURRENCE-ID" in vevent:
+            skipped.append(f"occurrence {vevent['RECURRENCE-ID'][0][1].strip()} of a recurring event")
+            continue
+        event = vevent_to_google_event(vevent, vtimezones, default_timezone)
+        if event is not None:
+            events.append(event)
+    return events, skipped
@@ -0,0 +1,227 @@
+##########################################################
+# Data source connectors for appointment extraction
+##########################################################
+# Each source (Gmail, Telegram, ...) is a SourceConnector registered with
+# @register_connector. A connector knows
+#   - whether it is enabled (INCLUDE_<NAME> in the environment),
+#   - its settings, read from <NAME>_<SETTING> in the environment with the
+#     defaults of the connector, e.g. GMAIL_BATCH_SIZE or TELEGRAM_RATE_LIMIT,
+#     and kept within the bounds of the connector,
+#   - how to fetch the records of a time window, and
+#   - the prompt pieces describing its data to the LLM.
+# Every connector keeps its own checkpoint, so sources advance independently.
+# State a source keeps besides that checkpoint (Gmail historyId, Telegram
+# high-water marks) is returned in the state dict by fetch() and only
+# persisted by commit() once the fetched records have been processed.
+#
+# A record is a dict {"source", "id", "sender", "text", ...} where text is
+# the message formatted for the prompt.
+##########################################################
+import os
+import time
+import asyncio
+import threading
+from dotenv import load_dotenv
+from google_email_calendar_libs import read_gmail_records, format_gmail_records, write_history_id, GMAIL_BATCH_SIZE
+from telegram_get_chats import (
+    telegram_get_chat_records, run_telegram_coroutine, set_rate_limiter, save_min_ids,
+    TELEGRAM_INGEST_MODE, TELEGRAM_MAX_CONCURRENCY
+)
+
+load_dotenv(override=True)
+
+_connectors = {}
+
+
+############################################################
+# Request pacing
+############################################################
+# Spaces requests at least 1/rate seconds apart, across threads. A rate of
+# 0 disables the limit.
+class RateLimiter:
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+            return start - now
+
+    def wait(self):
+        if self.interval:
+            delay = self._reserve()
+            if delay > 0:
+                time.sleep(delay)
+
+    async def wait_async(self):
+        if self.interval:
+            delay = self._reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+############################################################
+# Connector base class
+############################################################
+class SourceConnector:
+
+    # Short lower case name, used for the settings and the checkpoint file
+    name = None
+    # Settings the connector honours, with their defaults
+    default_settings = {"fetch_timeout": 600.0, "rate_limit": 0.0}
+    # (minimum, maximum) of the settings, None for no limit
+    setting_bounds = {"fetch_timeout": (1, None), "rate_limit": (0, None)}
+    # False when the source delivers its data outside the polling cycle
+    polled = True
+
+    system_prompt = ""
+    user_prompt = ""
+    data_prompt = ""
+
+    def __init__(self):
+        self.enabled = (os.getenv(f"INCLUDE_{self.name.upper()}") or "True") == "True"
+        self.settings = {
+            key: _read_setting(f"{self.name.upper()}_{key.upper()}", default, self.setting_bounds.get(key))
+            for key, default in self.default_settings.items()
+        }
+        self.rate_limiter = RateLimiter(self.settings.get("rate_limit", 0))
+
+    ############################################################
+    # Return the records of the window [after_ts, before_ts]
+    ############################################################
+    # Source state to persist once the records are processed goes in state,
+    # which has to stay JSON serializable.
+    def fetch(self, after_ts, before_ts, state):
+        raise NotImplementedError
+
+    ############################################################
+    # Persist the state returned by fetch()
+    ############################################################
+    def commit(self, state):
+        pass
+
+    ############################################################
+    # Format fetched records for the prompt
+    ############################################################
+    def format_records(self, records):
+        return "".join(record["text"] for record in records)
+
+
+def _read_setting(env_name, default, bounds=None):
+    try:
+        value = type(default)(os.getenv(env_name))
+    except (ValueError, TypeError):
+        return default
+    minimum, maximum = bounds or (None, None)
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+############################################################
+# Connector registry
+############################################################
+def register_connector(cls):
+    _connectors[cls.name] = cls()
+    return cls
+
+def get_connector(name):
+    return _connectors[name]
+
+############################################################
+# Enabled connectors in registration order
+############################################################
+def get_connectors(polled_only=False):
+    return [
+        connector for connector in _connectors.values()
+        if connector.enabled and (connector.polled or not polled_only)
+    ]
+
+
+############################################################
+# Gmail
+############################################################
+@register_connector
+class GmailConnector(SourceConnector):
+
+    name = "gmail"
+    default_settings = {"fetch_timeout": 600.0, "rate_limit": 0.0, "batch_size": GMAIL_BATCH_SIZE}
+    # Gmail rejects batches of more than 100 requests
+    setting_bounds = dict(SourceConnector.setting_bounds, batch_size=(1, 100))
+
+    system_prompt = """
+    You are a personal assistant who can check my emails, identify any appointments and create them in my google calendar.
+    """
+    user_prompt = """
+    Pls identify appointments based on the email data and email attachements given below.
+    """
+    data_prompt = """
+    For any attachments, parse the attachment and consider if there are any appointments in the attachment image or any other format.
+    If the attachment contains a flight, train, or bus ticket, extract the relevant travel details and convert them into a
+    calendar appointment. Use the departure and arrival dates and times from the ticket to set the appointment duration.
+    Include the origin and destination in the appointment title or description. Add the list of passengers (if available)
+    to the appointment body.
+    If there are any appointments in the attachment, include them in the above format.
+    Here are my emails and email attachement details: \n
+    """
+
+    def fetch(self, after_ts, before_ts, state):
+        return read_gmail_records(after_ts, before_ts, self.settings["batch_size"], self.rate_limiter, state)
+
+    def commit(self, state):
+        if state.get("history_id"):
+            write_history_id(state["history_id"])
+
+    def format_records(self, records):
+        return format_gmail_records(records)
+
+
+############################################################
+# Telegram
+############################################################
+# In "events" mode the messages arrive through the real-time ingestion
+# instead of the polling cycle.
+@register_connector
+class TelegramConnector(SourceConnector):
+
+    name = "telegram"
+    default_settings = {"fetch_timeout": 600.0, "rate_limit": 0.0, "max_concurrency": TELEGRAM_MAX_CONCURRENCY}
+    setting_bounds = dict(SourceConnector.setting_bounds, max_concurrency=(1, None))
+    polled = TELEGRAM_INGEST_MODE == "poll"
+
+    system_prompt = """
+    You are a personal assistant who can check my telegram messages, identify any appointments and create them in my google calendar.
+    Attendees is not required for Telegram messages.
+    """
+    user_prompt = """
+    Pls identify appointments based on the telegram chat messages data given below.
+    """
+    data_prompt = """
+    Here are my messages details from Telegram: \n
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Telegram limits the whole account, so the limiter is shared by every request
+        set_rate_limiter(self.rate_limiter)
+
+    def fetch(self, after_ts, before_ts, state):
+        timeout = self.settings["fetch_timeout"]
+        # Runs on the long lived Telegram event loop, which cancels it on timeout
+        return run_telegram_coroutine(
+            asyncio.wait_for(
+                telegram_get_chat_records(after_ts, before_ts, self.settings["max_concurrency"], state), timeout
+            ),
+            timeout + 5
+        )
+
+    def commit(self, state):
+        if "min_ids" in state:
+            save_min_ids(state["min_ids"])
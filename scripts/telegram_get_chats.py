@@ -7,13 +7,17 @@
 ################################################################################################
 
 import os
-from telethon import TelegramClient
-from datetime import datetime, timedelta
+import json
+from telethon import TelegramClient, events, utils
+from datetime import datetime, timedelta, timezone
 from telethon.tl.types import User,Channel,Chat,MessageService,MessageMediaPhoto
 from telethon.sessions import StringSession
+from telethon.errors import FloodWaitError
 import asyncio
+import threading
 from dotenv import load_dotenv
 from telegram_otp_auth import start_auth_flow
+from google_email_calendar_libs import write_atomic, logger
 import subprocess
 
 
@@ -29,133 +33,672 @@ SESSION_FILE=os.getenv("SESSION_FILE")
 output_file=os.getenv("OUTPUT_FILE_NAME")
 image_file_path=os.getenv("IMAGE_DOWNLOAD_PATH")
 
+#get daemon directory
+BASE_DIR = os.getenv("BASE_DIR") or os.path.dirname(os.path.abspath(__file__))
+DAEMON_DIR = os.getenv("DAEMON_DIR") or os.path.join(BASE_DIR, "daemon")
+
+#File keeping the highest message id read per dialog
+TELEGRAM_STATE_FILE = os.getenv("TELEGRAM_STATE_FILE") or os.path.join(DAEMON_DIR, "telegram_min_ids.json")
+
+#File keeping the "events" mode records whose processing failed, with the
+#high-water marks to save once they are processed
+TELEGRAM_PENDING_FILE = os.getenv("TELEGRAM_PENDING_FILE") or os.path.join(DAEMON_DIR, "telegram_pending_batch.json")
+
+#Sender display names can be kept between runs
+TELEGRAM_PERSIST_SENDER_CACHE = (os.getenv("TELEGRAM_PERSIST_SENDER_CACHE") or "True") == "True"
+TELEGRAM_SENDER_CACHE_FILE = os.getenv("TELEGRAM_SENDER_CACHE_FILE") or os.path.join(DAEMON_DIR, "telegram_senders.json")
+
+#"poll" scans the dialogs on every daemon cycle, "events" receives new
+#messages as they arrive and flushes them in micro batches
+TELEGRAM_INGEST_MODE = os.getenv("TELEGRAM_INGEST_MODE")
+if TELEGRAM_INGEST_MODE not in ("poll", "events"):
+    TELEGRAM_INGEST_MODE = "poll"
+
+#Micro batch triggers and buffer size for the "events" mode
+try:
+    TELEGRAM_FLUSH_COUNT = max(1, int(os.getenv("TELEGRAM_FLUSH_COUNT")))
+except (ValueError, TypeError):
+    TELEGRAM_FLUSH_COUNT = 20
+try:
+    TELEGRAM_FLUSH_SECONDS = float(os.getenv("TELEGRAM_FLUSH_SECONDS"))
+except (ValueError, TypeError):
+    TELEGRAM_FLUSH_SECONDS = 30
+try:
+    TELEGRAM_BUFFER_SIZE = max(1, int(os.getenv("TELEGRAM_BUFFER_SIZE")))
+except (ValueError, TypeError):
+    TELEGRAM_BUFFER_SIZE = 500
+
+#Number of dialogs scanned at the same time
+try:
+    TELEGRAM_MAX_CONCURRENCY = max(1, int(os.getenv("TELEGRAM_MAX_CONCURRENCY")))
+except (ValueError, TypeError):
+    TELEGRAM_MAX_CONCURRENCY = 8
+
+#Number of times a request is retried after a FloodWait
+try:
+    TELEGRAM_FLOOD_WAIT_RETRIES = int(os.getenv("TELEGRAM_FLOOD_WAIT_RETRIES"))
+except (ValueError, TypeError):
+    TELEGRAM_FLOOD_WAIT_RETRIES = 3
+
 
 ###############################################################
-#fetch_required_messages
+#FloodWait aware call
 ###############################################################
-async def fetch_required_messages(client, after_ts, before_ts):
-
-    # convert epoch time to datetime object
-    local_tz = datetime.now().astimezone().tzinfo
-    after_ts = datetime.fromtimestamp(after_ts, tz=local_tz)
-    before_ts = datetime.fromtimestamp(before_ts, tz=local_tz)
-
-    me = await client.get_me()
-
-    self_name = me.first_name or me.last_name or me.username or "Unknown"
-    # Fetch all chat dialogs
-    dialogs = await client.get_dialogs()
-
-    print(datetime.now(),"No of Telegram messages:", len(dialogs))
-    print(datetime.now()," - Fetch all chat dialogs - Done")
-    
-    chat_str=""
+#Telegram answers with FloodWait when too many requests are made. The wait
+#applies to the whole account, so every dialog task pauses until it is over.
+#An optional rate limiter (any object with an async wait_async()) paces the
+#requests of the whole account in the same way.
+_flood_wait_until = {"time": 0.0}
+_rate_limiter = {"limiter": None}
+
+def set_rate_limiter(limiter):
+    _rate_limiter["limiter"] = limiter
+
+async def call_with_flood_wait(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    for attempt in range(TELEGRAM_FLOOD_WAIT_RETRIES + 1):
+        delay = _flood_wait_until["time"] - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if _rate_limiter["limiter"] is not None:
+            await _rate_limiter["limiter"].wait_async()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as e:
+            if attempt == TELEGRAM_FLOOD_WAIT_RETRIES:
+                raise
+            print(datetime.now(), f"FloodWait of {e.seconds}s from Telegram. Backing off...")
+            _flood_wait_until["time"] = max(_flood_wait_until["time"], loop.time() + e.seconds + 1)
+        #End try
+    #End for
 
-    for dialog in dialogs:
-        if not dialog.name:  # Skip dialogs without a name
-            continue
+###############################################################
+#collect_window_messages
+###############################################################
+#Walks the dialog backwards from before_ts and stops at the first message
+#older than after_ts, so old history is never downloaded. Returns the
+#messages in chronological order.
+async def collect_window_messages(client, dialog_id, after_ts, before_ts, min_id):
+    messages = []
+    async for msg in client.iter_messages(dialog_id, offset_date=before_ts, min_id=min_id):
+        if msg.date < after_ts:
+            break
         #End if
-
-        #Ignoring telegram automated messages.
-        if dialog.name=='Telegram':
-            continue
-        #End If
-
-        #Checking if dialog has any messages and not processing them
-        messages = await client.get_messages(dialog.id, limit=1)
-        if not messages or isinstance(messages[0], MessageService):
+        if isinstance(msg, MessageService):
             continue
         #End if
+        #Warm the sender cache with the entities returned along with the batch
+        remember_sender(msg.sender_id, msg.sender)
+        messages.append(msg)
+    #End for
+    messages.reverse()
+    return messages
 
-        print(messages[0].date)
-        chat_ts = messages[0].date
-        print(f"Chat time: {chat_ts}")
-
-        # chat_date=datetime.strptime(str(messages[0].date.date()
+###############################################################
+#Per dialog high-water marks
+###############################################################
+#Highest message id read per dialog, kept between runs so the next run
+#only asks Telegram for newer messages.
+def load_min_ids():
+    if os.path.exists(TELEGRAM_STATE_FILE):
+        try:
+            with open(TELEGRAM_STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (ValueError, OSError):
+            print(datetime.now(), "Telegram state file is unreadable. Starting without high-water marks.")
+        #End try
+    #End if
+    return {}
+
+def save_min_ids(min_ids):
+    write_atomic(TELEGRAM_STATE_FILE, json.dumps(min_ids))
 
-        if chat_ts < after_ts:
-            continue
+###############################################################
+#Sender cache
+###############################################################
+#Display details per sender id, so names are resolved without a network
+#lookup once the entity is known. Entries are {"kind": "self"|"user"|"chat",
+#"name": ...}; for "chat" senders the dialog name is used.
+_sender_cache = {"entries": None}
+
+def get_sender_cache():
+    if _sender_cache["entries"] is None:
+        _sender_cache["entries"] = {}
+        if TELEGRAM_PERSIST_SENDER_CACHE and os.path.exists(TELEGRAM_SENDER_CACHE_FILE):
+            try:
+                with open(TELEGRAM_SENDER_CACHE_FILE, "r", encoding="utf-8") as f:
+                    _sender_cache["entries"] = json.load(f)
+            except (ValueError, OSError):
+                print(datetime.now(), "Telegram sender cache file is unreadable. Starting with an empty cache.")
+            #End try
         #End if
+    #End if
+    return _sender_cache["entries"]
+
+def save_sender_cache():
+    if not TELEGRAM_PERSIST_SENDER_CACHE or _sender_cache["entries"] is None:
+        return
+    #End if
+    tmp_file = TELEGRAM_SENDER_CACHE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(_sender_cache["entries"], f)
+    #End With
+    os.replace(tmp_file, TELEGRAM_SENDER_CACHE_FILE)
+
+def remember_sender(sender_id, sender):
+    if sender_id is None or sender is None:
+        return None
+    #End if
+    if isinstance(sender, User):
+        entry = {
+            "kind": "self" if sender.is_self else "user",
+            "name": sender.first_name or sender.last_name or sender.username or "Unknown",
+        }
+    elif isinstance(sender, (Channel, Chat)):  # If sender is a Channel or Group Chat
+        entry = {"kind": "chat", "name": sender.title}
+    else:
+        return None
+    #End if
+    get_sender_cache()[str(sender_id)] = entry
+    return entry
+
+#Dialogs are scanned concurrently, so one lookup per unknown sender is shared
+_sender_lookups = {}
+
+async def lookup_sender(msg):
+    if msg.sender_id is None:
+        return await call_with_flood_wait(msg.get_sender)
+    #End if
+    key = str(msg.sender_id)
+    task = _sender_lookups.get(key)
+    if task is None:
+        task = _sender_lookups[key] = asyncio.ensure_future(call_with_flood_wait(msg.get_sender))
+    #End if
+    try:
+        return await task
+    finally:
+        _sender_lookups.pop(key, None)
+    #End try
+
+async def resolve_sender_name(msg, dialog_name, self_name):
+    entry = get_sender_cache().get(str(msg.sender_id)) if msg.sender_id is not None else None
+    if entry is None:
+        #Only unknown senders need a network lookup
+        sender = msg.sender or await lookup_sender(msg)
+        entry = remember_sender(msg.sender_id, sender)
+    #End if
+
+    if entry is None:
+        return 'Unknown'
+    elif entry["kind"] == "self":
+        return self_name
+    elif entry["kind"] == "chat":
+        return dialog_name  # Use the group/channel name
+    #End if
+    return entry["name"]
 
-        # Fetch messages from the chat in the last 24 hours
-        messages = await client.get_messages(dialog.id, limit=9999)  # Adjust limit as needed
-
-        sorted_messages = sorted(messages, key=lambda msg: msg.date)
-        #print(datetime.now()," - Sorted ",dialog.name ,"Messages - Done")
+###############################################################
+#scan_dialog
+###############################################################
+async def scan_dialog(client, dialog, semaphore, after_ts, before_ts, self_name, min_ids):
+
+    if not dialog.name:  # Skip dialogs without a name
+        return []
+    #End if
+
+    #Ignoring telegram automated messages.
+    if dialog.name=='Telegram':
+        return []
+    #End If
+
+    async with semaphore:
+        # Read only the messages inside the window that are newer than the
+        # high-water mark of the previous run
+        min_id = min_ids.get(str(dialog.id), 0)
+        sorted_messages = await call_with_flood_wait(
+            collect_window_messages, client, dialog.id, after_ts, before_ts, min_id
+        )
+        if not sorted_messages:
+            return []
+        #End if
 
+        chat_records = []
         for msg in sorted_messages:
 
             print("MSG:",msg.id," - ",msg.date," - ",msg.text)
             chat_ts=msg.date
             if chat_ts and chat_ts >= after_ts and chat_ts <= before_ts:
-
-                #fetching sender details
-                sender = await msg.get_sender()
-
-                if isinstance(sender, User) and  sender.is_self:
-                    sender_name = self_name
-                elif isinstance(sender, User) and not sender.is_self:
-                    sender_name = sender.first_name or sender.last_name or sender.username or "Unknown"
-                elif isinstance(sender, (Channel, Chat)):  # If sender is a Channel or Group Chat
-                    sender_name = dialog.name  # Use the group/channel name
-                else:
-                    sender_name = 'Unknown'
-                #End if
-
-                #Check if the msg is of media type and fetch the media details
-                if msg.media and isinstance(msg.media, MessageMediaPhoto):
-                    # Check if the message has an image
-                    if msg.photo:
-                        print(f"Downloading image from message {msg.id}...")
-                        # Download the image
-                        file_path = await client.download_media(msg, file=f"{image_file_path}/{sender_name}_image_{msg.id}.jpg")
-                        print(f"Image saved at: {file_path}")
-                    #End if
-                #End If
-
-                #Loading data into the file
-                chat_str = chat_str + f"""
-                    Chat with: {dialog.name}\n 
-                    Message Type : {'sent' if msg.out else 'Received'}\n 
-                    Sender : {sender_name}\n 
-                    Message : {msg.text if msg.text else '[Media/Sticker]'}\n 
-                    Time : {msg.date.strftime('%Y-%m-%d %I:%M:%S %p %Z')} \n
-                """
-
-                #Add media details
-                chat_str += file_path if msg.media and isinstance(msg.media, MessageMediaPhoto) else ""
-                #if images
+                chat_records.append(await format_chat_message(client, msg, dialog.name, self_name))
             #End if
         #End for
-    #End for
-    await client.disconnect()
+    #End with
+
+    #Only advanced once every record of the dialog is built, so a failure
+    #above leaves the messages to be read again
+    min_ids[str(dialog.id)] = max(min_id, sorted_messages[-1].id)
+    return chat_records
+
+###############################################################
+#format_chat_message
+###############################################################
+#Returns the message as a prompt record: {"source", "id", "sender", "text",
+#"content"}, where text is formatted for the LLM prompt and content is the
+#message text itself
+async def format_chat_message(client, msg, dialog_name, self_name):
+
+    #fetching sender details
+    sender_name = await resolve_sender_name(msg, dialog_name, self_name)
+
+    #Check if the msg is of media type and fetch the media details
+    file_path = None
+    if msg.media and isinstance(msg.media, MessageMediaPhoto):
+        # Check if the message has an image
+        if msg.photo:
+            print(f"Downloading image from message {msg.id}...")
+            # Download the image
+            file_path = await call_with_flood_wait(client.download_media, msg, file=f"{image_file_path}/{sender_name}_image_{msg.id}.jpg")
+            print(f"Image saved at: {file_path}")
+        #End if
+    #End If
+
+    #Loading data into the file
+    chat_str = f"""
+        Chat with: {dialog_name}\n 
+        Message Type : {'sent' if msg.out else 'Received'}\n 
+        Sender : {sender_name}\n 
+        Message : {msg.text if msg.text else '[Media/Sticker]'}\n 
+        Time : {msg.date.strftime('%Y-%m-%d %I:%M:%S %p %Z')} \n
+    """
+
+    #Add media details
+    chat_str += file_path or ""
+    return {
+        "source": "telegram",
+        "id": f"{msg.chat_id}:{msg.id}",
+        "sender": sender_name,
+        "text": chat_str,
+        "content": msg.text or "",
+    }
+
+###############################################################
+#get_self_name
+###############################################################
+async def get_self_name(client):
+    me = await client.get_me()
+    return me.first_name or me.last_name or me.username or "Unknown"
+
+###############################################################
+#fetch_required_messages
+###############################################################
+#Returns the prompt records of every dialog, at most max_concurrency
+#(TELEGRAM_MAX_CONCURRENCY by default) dialogs being scanned at a time.
+#When a state dict is given, the new high-water marks are put in
+#state["min_ids"] for the caller to save with save_min_ids() once the
+#messages have been processed; otherwise they are saved right away.
+#Raises when a dialog could not be read, without saving anything.
+async def fetch_required_messages(client, after_ts, before_ts, max_concurrency=None, state=None):
+
+    # convert epoch time to datetime object
+    local_tz = datetime.now().astimezone().tzinfo
+    after_ts = datetime.fromtimestamp(after_ts, tz=local_tz)
+    before_ts = datetime.fromtimestamp(before_ts, tz=local_tz)
+
+    self_name = await get_self_name(client)
+    # Fetch all chat dialogs
+    dialogs = await client.get_dialogs()
 
-    return chat_str
+    print(datetime.now(),"No of Telegram messages:", len(dialogs))
+    print(datetime.now()," - Fetch all chat dialogs - Done")
+
+    # Scan the dialogs concurrently. gather() keeps the results in dialog order.
+    semaphore = asyncio.Semaphore(max_concurrency or TELEGRAM_MAX_CONCURRENCY)
+    min_ids = load_min_ids()
+    results = await asyncio.gather(
+        *(scan_dialog(client, dialog, semaphore, after_ts, before_ts, self_name, min_ids) for dialog in dialogs),
+        return_exceptions=True
+    )
+
+    chat_records = []
+    errors = []
+    for dialog, result in zip(dialogs, results):
+        if isinstance(result, Exception):
+            print(datetime.now(), f"Error reading dialog {dialog.name}: {result}")
+            errors.append(result)
+            continue
+        #End if
+        chat_records.extend(result)
+    #End for
+    #A failed dialog fails the fetch, so the window stays pending and the
+    #dialog is read again on the next cycle
+    if errors:
+        save_sender_cache()
+        raise RuntimeError(f"{len(errors)} Telegram dialog(s) could not be read: {errors[0]}") from errors[0]
+    #End if
+    if state is None:
+        save_min_ids(min_ids)
+    else:
+        state["min_ids"] = min_ids
+    #End if
+    save_sender_cache()
+
+    return chat_records
     # with open(output_file, "w", encoding="utf-8") as file:
     #     file.write(chat_str)
     # #End With
 
+##############################################################################
+#Long lived event loop and client
+##############################################################################
+#The client is bound to the event loop it was created on, so one loop runs in
+#a background thread for the life of the process and every Telegram
+#coroutine is submitted to it. The client stays connected between daemon
+#cycles; Telethon reconnects it on network errors and get_client() connects
+#it again if it was dropped.
+_telegram = {"loop": None, "thread": None, "client": None}
+_telegram_lock = threading.Lock()
+
+def get_telegram_loop():
+    with _telegram_lock:
+        if _telegram["loop"] is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="telegram-loop", daemon=True)
+            thread.start()
+            _telegram["loop"] = loop
+            _telegram["thread"] = thread
+        #End if
+    #End with
+    return _telegram["loop"]
+
+def submit_telegram_coroutine(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_telegram_loop())
+
+def run_telegram_coroutine(coro, timeout=None):
+    return submit_telegram_coroutine(coro).result(timeout)
+
+async def get_client():
+    client = _telegram["client"]
+    if client is None:
+        session_string = None
+        if os.path.exists(SESSION_FILE):
+            print("Session file exists. Loading session...")
+            with open(SESSION_FILE, 'r') as session_file:
+                session_string = session_file.read()
+            #End With
+        #End if
+        client = _telegram["client"] = TelegramClient(StringSession(session_string), api_id, api_hash)
+    #End if
+
+    if not client.is_connected():
+        await client.connect()
+    #End if
+    return client
+
+async def drop_client():
+    client = _telegram["client"]
+    _telegram["client"] = None
+    if client is not None:
+        await client.disconnect()
+    #End if
+
+def close_telegram():
+    if _telegram["loop"] is None:
+        return
+    #End if
+    try:
+        run_telegram_coroutine(stop_event_ingestion(), timeout=TELEGRAM_FLUSH_SECONDS + 300)
+        run_telegram_coroutine(drop_client(), timeout=30)
+    finally:
+        loop = _telegram["loop"]
+        loop.call_soon_threadsafe(loop.stop)
+        _telegram["thread"].join(timeout=30)
+        loop.close()
+        _telegram["loop"] = None
+        _telegram["thread"] = None
+    #End try
+
 ##############################################################################
 #Main
 ##############################################################################
+#Must run on the loop returned by get_telegram_loop(), e.g.
+#run_telegram_coroutine(telegram_get_chats(after_ts, before_ts))
 async def telegram_get_chats(after_ts, before_ts):
-    session_string = None
+    chat_records = await telegram_get_chat_records(after_ts, before_ts)
+    return "".join(record["text"] for record in chat_records)
 
-    if os.path.exists(SESSION_FILE):
-        print("Session file exists. Loading session...")
-        with open(SESSION_FILE, 'r') as session_file:
-            session_string = session_file.read()
-    
-    client = TelegramClient(StringSession(session_string), api_id, api_hash)
-    await client.connect()
+async def telegram_get_chat_records(after_ts, before_ts, max_concurrency=None, state=None):
+    client = await get_client()
 
     if not await client.is_user_authorized():
         print("Session is invalid or expired. Starting auth flow...")
-        await client.disconnect()  # Clean up before launching UI
+        await drop_client()  # Clean up before launching UI
 
         # 🔁 Run auth flow in a subprocess (avoids event loop conflict)
         subprocess.run(["python", "telegram_invoke_auth.py"], check=True)
 
-        return await telegram_get_chats(after_ts, before_ts)
+        return await telegram_get_chat_records(after_ts, before_ts, max_concurrency, state)
+
+    return await fetch_required_messages(client, after_ts, before_ts, max_concurrency, state)
+
+##############################################################################
+#Real-time ingestion
+##############################################################################
+#Instead of scanning every dialog on each daemon cycle, subscribe to
+#NewMessage events and hand the messages to on_batch(chat_records) in micro
+#batches: as soon as TELEGRAM_FLUSH_COUNT messages are buffered, or
+#TELEGRAM_FLUSH_SECONDS after the first buffered message, whichever comes
+#first. on_batch is blocking (LLM + calendar calls) and runs in a worker
+#thread so the loop keeps receiving updates. When on_batch fails, the
+#records are kept in TELEGRAM_PENDING_FILE and handed over again with the
+#next flush; the high-water marks only advance once on_batch succeeded.
+#Events only report messages received while connected, so before the first
+#flush the dialogs are caught up: every message newer than the high-water
+#mark of its dialog, and for dialogs without a mark every message since the
+#marks were last saved, is flushed first. Messages at or below the marks are
+#skipped, so the ones received during the catch-up are not read twice.
+#The buffer holds at most
+#TELEGRAM_BUFFER_SIZE messages; when it is full the handler waits for the
+#flush to catch up.
+_ingestion = {"queue": None, "task": None, "handler": None}
+
+async def start_event_ingestion(on_batch):
+    if _ingestion["task"] is not None:
+        return
+    #End if
+
+    client = await get_client()
+    if not await client.is_user_authorized():
+        print("Session is invalid or expired. Starting auth flow...")
+        await drop_client()
+        subprocess.run(["python", "telegram_invoke_auth.py"], check=True)
+        return await start_event_ingestion(on_batch)
+    #End if
+
+    self_name = await get_self_name(client)
+    queue = asyncio.Queue(maxsize=TELEGRAM_BUFFER_SIZE)
+
+    async def handler(event):
+        if isinstance(event.message, MessageService):
+            return
+        #End if
+        await queue.put(event.message)
+
+    client.add_event_handler(handler, events.NewMessage)
+    _ingestion.update({
+        "queue": queue,
+        "handler": handler,
+        "task": asyncio.get_running_loop().create_task(_flush_loop(client, queue, on_batch, self_name)),
+    })
+    print(datetime.now(), "Telegram real-time ingestion started")
+
+async def stop_event_ingestion():
+    task = _ingestion["task"]
+    if task is None:
+        return
+    #End if
+    client = _telegram["client"]
+    if client is not None:
+        client.remove_event_handler(_ingestion["handler"])
+    #End if
+    #None tells the flush loop to hand over what is buffered and stop
+    await _ingestion["queue"].put(None)
+    await task
+    _ingestion.update({"queue": None, "task": None, "handler": None})
+
+async def _next_batch(queue):
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+    while len(batch) < TELEGRAM_FLUSH_COUNT:
+        if deadline is None:
+            msg = await queue.get()
+            deadline = loop.time() + TELEGRAM_FLUSH_SECONDS
+        else:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            #End if
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            #End try
+        #End if
+        if msg is None:
+            return batch, True
+        #End if
+        batch.append(msg)
+    #End while
+    return batch, False
+
+def load_pending_batch():
+    if os.path.exists(TELEGRAM_PENDING_FILE):
+        try:
+            with open(TELEGRAM_PENDING_FILE, "r", encoding="utf-8") as f:
+                pending = json.load(f)
+            return pending["records"], pending["min_ids"]
+        except (ValueError, KeyError, OSError) as e:
+            logger('INFO', f"Pending Telegram batch is unreadable, dropping it: {e}")
+        #End try
+    #End if
+    return [], {}
+
+def save_pending_batch(chat_records, min_ids):
+    write_atomic(TELEGRAM_PENDING_FILE, json.dumps({"records": chat_records, "min_ids": min_ids}))
+
+async def _flush_batch(client, batch, on_batch, self_name):
+    loop = asyncio.get_running_loop()
+    #Records of earlier flushes that failed come first
+    chat_records, min_ids = load_pending_batch()
+    #Messages already read (or pending) are skipped
+    read_ids = load_min_ids()
+    for dialog_key, min_id in min_ids.items():
+        read_ids[dialog_key] = max(read_ids.get(dialog_key, 0), min_id)
+    #End for
+    for msg in batch:
+        dialog_key = str(msg.chat_id)
+        if msg.id <= read_ids.get(dialog_key, 0):
+            continue
+        #End if
+        read_ids[dialog_key] = msg.id
+        chat = await call_with_flood_wait(msg.get_chat)
+        dialog_name = utils.get_display_name(chat) if chat else ""
+        #Same dialogs are skipped as in the polling scan
+        if not dialog_name or dialog_name == 'Telegram':
+            continue
+        #End if
+        try:
+            chat_records.append(await format_chat_message(client, msg, dialog_name, self_name))
+        except Exception as e:
+            #The records already built are still processed or kept pending
+            logger('INFO', f"Error reading Telegram message {msg.chat_id}:{msg.id}, skipping it: {e}")
+            continue
+        #End try
+        min_ids[dialog_key] = max(min_ids.get(dialog_key, 0), msg.id)
+    #End for
 
-    return await fetch_required_messages(client, after_ts, before_ts)
+    save_sender_cache()
+    if chat_records:
+        logger('INFO', f"Flushing {len(chat_records)} Telegram message(s) to appointment extraction")
+        try:
+            await loop.run_in_executor(None, on_batch, chat_records)
+        except Exception:
+            save_pending_batch(chat_records, min_ids)
+            raise
+        #End try
+    #End if
+    #Polling from the same state later does not read these messages again
+    saved_min_ids = load_min_ids()
+    for dialog_key, min_id in min_ids.items():
+        saved_min_ids[dialog_key] = max(saved_min_ids.get(dialog_key, 0), min_id)
+    #End for
+    save_min_ids(saved_min_ids)
+    if os.path.exists(TELEGRAM_PENDING_FILE):
+        os.remove(TELEGRAM_PENDING_FILE)
+    #End if
+
+###############################################################
+#Catch up on the messages received while not listening
+###############################################################
+#Returns the messages newer than the high-water marks, per dialog in
+#chronological order. Dialogs without a mark are read from the time the marks
+#were last saved; without a state file nothing is caught up.
+async def _catch_up_messages(client):
+    if not os.path.exists(TELEGRAM_STATE_FILE):
+        logger('INFO', "No Telegram high-water marks yet, nothing to catch up")
+        return []
+    #End if
+    min_ids = load_min_ids()
+    since = datetime.fromtimestamp(os.path.getmtime(TELEGRAM_STATE_FILE), tz=timezone.utc)
+    epoch = datetime.fromtimestamp(0, tz=timezone.utc)
+
+    dialogs = await call_with_flood_wait(client.get_dialogs)
+    messages = []
+    for dialog in dialogs:
+        #Same dialogs are skipped as in the polling scan
+        if not dialog.name or dialog.name == 'Telegram':
+            continue
+        #End if
+        min_id = min_ids.get(str(dialog.id))
+        after_ts = since if min_id is None else epoch
+        messages.extend(await call_with_flood_wait(
+            collect_window_messages, client, dialog.id, after_ts, None, min_id or 0
+        ))
+    #End for
+    logger('INFO', f"{len(messages)} Telegram message(s) received while not listening")
+    return messages
+
+async def _flush_loop(client, queue, on_batch, self_name):
+    #Messages received while the daemon was down are flushed before the
+    #events, in batches of TELEGRAM_FLUSH_COUNT
+    try:
+        missed = await _catch_up_messages(client)
+    except Exception as e:
+        logger('INFO', f"Error catching up on Telegram messages: {e}")
+        missed = []
+    #End try
+    for start in range(0, len(missed), TELEGRAM_FLUSH_COUNT):
+        try:
+            await _flush_batch(client, missed[start:start + TELEGRAM_FLUSH_COUNT], on_batch, self_name)
+        except Exception as e:
+            logger('INFO', f"Error processing Telegram messages, keeping them for the next flush: {e}")
+        #End try
+    #End for
+
+    #Records left pending by the previous run are retried right away
+    stopping = False
+    batch = []
+    retry = os.path.exists(TELEGRAM_PENDING_FILE)
+    while True:
+        if batch or retry:
+            try:
+                await _flush_batch(client, batch, on_batch, self_name)
+            except Exception as e:
+                logger('INFO', f"Error processing Telegram messages, keeping them for the next flush: {e}")
+            #End try
+        #End if
+        if stopping:
+            break
+        #End if
+        batch, stopping = await _next_batch(queue)
+        retry = False
+    #End while
@@ -0,0 +1,35 @@
+##########################################################
+# Token counts of prompt text
+##########################################################
+# Used to keep prompts within the token budget of the model. The tiktoken
+# encoding of the model is used when tiktoken is installed (o200k_base for
+# models tiktoken does not know), otherwise the count is estimated at 4
+# characters per token.
+##########################################################
+import threading
+
+# tiktoken is optional, without it token counts are estimated
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Encodings by model, loaded once
+_encodings = {}
+_lock = threading.Lock()
+
+
+def count_tokens(text, model):
+    if tiktoken is None:
+        return len(text) // 4 + 1
+    encoding = _encodings.get(model)
+    if encoding is None:
+        with _lock:
+            encoding = _encodings.get(model)
+            if encoding is None:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("o200k_base")
+                _encodings[model] = encoding
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,34 @@
+import pytest
+
+from event_dedup_index import EventDedupIndex
+
+
+def make_event(summary, start, end):
+    return {"summary": summary, "start": {"dateTime": start}, "end": {"dateTime": end}}
+
+
+@pytest.mark.parametrize("existing, new", [
+    ("Meeting", "Meeting with landlord"),
+    ("Call", "Call with bank"),
+    ("Dentist", "Dentist appointment for Riya"),
+    ("Interview", "Interview - Acme"),
+    ("Trip to Goa", "Flight to Mumbai"),
+])
+def test_distinct_events_are_not_duplicates(existing, new):
+    index = EventDedupIndex(threshold=0.8, time_window_minutes=180)
+    index.add(make_event(existing, "2025-04-02T10:00:00+05:30", "2025-04-02T11:00:00+05:30"))
+    assert index.find_duplicate(make_event(new, "2025-04-02T12:00:00+05:30", "2025-04-02T13:00:00+05:30")) is None
+
+
+def test_same_trip_from_two_sources_is_a_duplicate():
+    index = EventDedupIndex(threshold=0.8, time_window_minutes=180)
+    index.add(make_event("Flight BLR-GOA", "2025-04-02T10:00:00+05:30", "2025-04-02T11:15:00+05:30"))
+    match = index.find_duplicate(make_event("Trip to Goa", "2025-04-02T10:00:00+05:30", "2025-04-02T11:00:00+05:30"))
+    assert match is not None
+    assert match[0]["summary"] == "Flight BLR-GOA"
+
+
+def test_event_far_apart_in_time_is_not_a_duplicate():
+    index = EventDedupIndex(threshold=0.8, time_window_minutes=180)
+    index.add(make_event("Flight BLR-GOA", "2025-04-02T10:00:00+05:30", "2025-04-02T11:15:00+05:30"))
+    assert index.find_duplicate(make_event("Trip to Goa", "2025-04-09T10:00:00+05:30", "2025-04-09T11:00:00+05:30")) is None
@@ -0,0 +1,85 @@
+import pytest
+
+from ics_parser import ics_to_google_events
+
+INVITE = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Example//Calendar//EN
+{method}BEGIN:VEVENT
+UID:review-42@example.com
+DTSTAMP:20261001T080000Z
+DTSTART:20261020T093000Z
+DTEND:20261020T103000Z
+SUMMARY:{summary}
+ORGANIZER:mailto:organizer@example.com
+ATTENDEE;PARTSTAT={partstat}:mailto:guest@example.com
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+def invite(method, summary="Design review", partstat="NEEDS-ACTION"):
+    method_line = f"METHOD:{method}\r\n" if method else ""
+    return INVITE.format(method=method_line, summary=summary, partstat=partstat).replace("\n", "\r\n")
+
+
+@pytest.mark.parametrize("method", [None, "REQUEST", "PUBLISH"])
+def test_invites_become_events(method):
+    events, skipped = ics_to_google_events(invite(method))
+    assert skipped == []
+    assert len(events) == 1
+    assert events[0]["summary"] == "Design review"
+    assert events[0]["iCalUID"] == "review-42@example.com"
+
+
+def test_reply_is_not_an_event():
+    events, skipped = ics_to_google_events(invite("REPLY", "Accepted: Design review", "ACCEPTED"))
+    assert events == []
+    assert len(skipped) == 1
+
+
+@pytest.mark.parametrize("method", ["CANCEL", "COUNTER", "REFRESH", "DECLINECOUNTER"])
+def test_other_methods_are_skipped(method):
+    events, skipped = ics_to_google_events(invite(method))
+    assert events == []
+    assert len(skipped) == 1
+
+
+SERIES = """BEGIN:VCALENDAR
+VERSION:2.0
+METHOD:REQUEST
+BEGIN:VEVENT
+UID:standup-7@example.com
+DTSTAMP:20261001T080000Z
+DTSTART:20261019T040000Z
+DTEND:20261019T041500Z
+RRULE:FREQ=WEEKLY;BYDAY=MO
+SUMMARY:Standup
+END:VEVENT
+BEGIN:VEVENT
+UID:standup-7@example.com
+RECURRENCE-ID:20261026T040000Z
+DTSTAMP:20261001T080000Z
+DTSTART:20261026T050000Z
+DTEND:20261026T051500Z
+SUMMARY:Standup (moved)
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+
+def test_occurrence_override_is_skipped():
+    events, skipped = ics_to_google_events(SERIES)
+    assert [event["summary"] for event in events] == ["Standup"]
+    assert events[0]["recurrence"] == ["RRULE:FREQ=WEEKLY;BYDAY=MO"]
+    assert len(skipped) == 1
+    assert "20261026T040000Z" in skipped[0]
+
+
+def test_occurrence_override_alone_is_skipped():
+    lines = SERIES.split("\r\n")
+    start = lines.index("BEGIN:VEVENT", lines.index("END:VEVENT"))
+    override_only = "\r\n".join(lines[:3] + lines[start:])
+    events, skipped = ics_to_google_events(override_only)
+    assert events == []
+    assert len(skipped) == 1
@@ -0,0 +1,25 @@
+import pytest
+
+from message_prefilter import MessagePrefilter
+
+WEEKDAYS = [
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "mon", "tue", "tues", "wed", "thu", "thur", "thurs", "fri", "sat", "sun",
+]
+
+
+@pytest.mark.parametrize("day", WEEKDAYS)
+def test_weekday_names_are_scheduling_signal(day):
+    prefilter = MessagePrefilter(threshold=2)
+    kept, dropped = prefilter.filter([{"content": f"Dinner on {day.capitalize()}?"}])
+    assert kept and not dropped
+
+
+@pytest.mark.parametrize("text", ["Sundays are slow", "Wedding photos attached", "Mondays"])
+def test_words_starting_with_a_weekday_are_not_signal(text):
+    assert MessagePrefilter().score_batch([{"content": text}]) == [0]
+
+
+def test_otp_message_is_dropped():
+    kept, dropped = MessagePrefilter(threshold=2).filter([{"content": "Your OTP is 482913"}])
+    assert not kept and dropped